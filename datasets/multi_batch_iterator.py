@@ -1,27 +1,90 @@
-from random import shuffle
+from random import Random
+from datasets.batch import Batch
 from datasets.batch_iterator import BatchIterator
 
 
 class MultiBatchIterator:
-    def __init__(self, contents, embedding_handler, sentence_len, batch_size):
+    def __init__(self, contents, embedding_handler, sentence_len, batch_size, seed=None,
+                 shard_index=0, num_shards=1, length_buckets=None, pad_ragged_batches=False):
         self.contents = contents
         self.min_content_length = min([len(d) for d in self.contents])
         self.embedding_handler = embedding_handler
         self.sentence_len = sentence_len
         self.batch_size = batch_size
+        self.seed = seed
+        # every worker of a distributed run takes a disjoint part of each epoch
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        # with length buckets every batch has exactly batch_size sentences and one of a few lengths, so the shapes fed
+        # to the model are known in advance
+        self.length_buckets = None
+        if length_buckets is not None:
+            self.length_buckets = sorted(set([b for b in length_buckets if b < sentence_len] + [sentence_len]))
+        self.pad_ragged_batches = pad_ragged_batches
 
-    def get_iterator(self, content):
+    def get_iterator(self, content, rng, skip_batches):
         # since we want the data in each epoch to be different we shuffle beforehand
-        shuffle(content)
+        content = list(content)
+        rng.shuffle(content)
         # take a random prefix which is the size of the smallest dataset
         content = content[:self.min_content_length]
-        batch_iterator = BatchIterator(content, self.embedding_handler, self.sentence_len, self.batch_size)
+        if self.num_shards > 1:
+            # the shards are the same size so all the workers run the same number of batches
+            shard_length = self.min_content_length // self.num_shards
+            content = content[self.shard_index:shard_length * self.num_shards:self.num_shards]
+        # without the batches to skip
+        content = content[skip_batches * self.batch_size:]
+        batch_iterator = BatchIterator(content, self.embedding_handler, self.sentence_len, self.batch_size,
+                                       shuffle_sentences=False)
         return batch_iterator
 
-    def __iter__(self):
-        for res in zip(*[self.get_iterator(d) for d in self.contents]):
+    def get_epoch(self, epoch_num, skip_batches=0):
+        # with a seed the order of an epoch only depends on the seed and the epoch number, so it can be resumed from
+        # any batch
+        if self.seed is None or epoch_num is None:
+            rng = Random()
+        else:
+            rng = Random(self.seed * 1000003 + epoch_num)
+        for res in zip(*[self.get_iterator(d, rng, skip_batches) for d in self.contents]):
+            if self.length_buckets is not None:
+                res = self.to_static_shape(res)
+                if res is None:
+                    continue
             yield res
 
+    def to_static_shape(self, batches):
+        if batches[0].get_len() < self.batch_size:
+            # the last batch of the epoch
+            if not self.pad_ragged_batches:
+                return None
+            batches = [self.fill_batch(b) for b in batches]
+        longest = max([max(b.lengths) for b in batches])
+        bucket = [b for b in self.length_buckets if b >= longest][0]
+        return tuple([self.trim_batch(b, bucket) for b in batches])
+
+    def fill_batch(self, batch):
+        # repeat the sentences of the batch until it is full
+        res = Batch()
+        for i in range(self.batch_size):
+            res.add(batch.sentences[i % batch.get_len()], batch.lengths[i % batch.get_len()])
+        return res
+
+    @staticmethod
+    def trim_batch(batch, length):
+        res = Batch()
+        for sentence, sentence_length in zip(batch.sentences, batch.lengths):
+            res.add(sentence[:length], min(sentence_length, length))
+        return res
+
+    def get_warm_up_batches(self):
+        # a batch of every shape the iterator can return
+        first_batches = next(zip(*[self.get_iterator(d, Random(), 0) for d in self.contents]))
+        batches = [self.fill_batch(b) for b in first_batches]
+        return [tuple([self.trim_batch(b, bucket) for b in batches]) for bucket in self.length_buckets]
+
+    def __iter__(self):
+        return self.get_epoch(None)
+
     @staticmethod
     def preprocess(datasets):
         contents = []
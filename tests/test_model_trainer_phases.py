@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from v1_embedding.model_trainer import ModelTrainer
+
+
+def create_trainer(accumulation_steps, initial_generator_epochs, min_generator_steps, min_discriminator_steps):
+    # should_train_generator only uses the trainer config
+    trainer = ModelTrainer.__new__(ModelTrainer)
+    trainer.config = {'trainer': {
+        'accumulation_steps': accumulation_steps,
+        'initial_generator_epochs': initial_generator_epochs,
+        'min_generator_steps': min_generator_steps,
+        'min_discriminator_steps': min_discriminator_steps,
+    }}
+    trainer.update_phase = None
+    return trainer
+
+
+def get_phases(trainer, epochs, batches_per_epoch):
+    # the model trained by every micro batch, in the order of the training loop
+    phases = []
+    global_step = 0
+    for epoch in range(epochs):
+        for _ in range(batches_per_epoch):
+            phases.append((global_step, trainer.should_train_generator(epoch, global_step)))
+            global_step += 1
+    return phases
+
+
+@pytest.mark.parametrize('batches_per_epoch', [5, 7, 9])
+def test_update_keeps_phase_across_initial_generator_epochs(batches_per_epoch):
+    accumulation_steps = 2
+    trainer = create_trainer(accumulation_steps, initial_generator_epochs=1, min_generator_steps=1,
+                             min_discriminator_steps=3)
+    phases = get_phases(trainer, epochs=3, batches_per_epoch=batches_per_epoch)
+    for global_step, is_generator in phases:
+        update_start = global_step - global_step % accumulation_steps
+        assert is_generator == phases[update_start][1]
+    # the update that crosses the end of the first epoch still trains the generator
+    assert phases[batches_per_epoch][1]
+    assert not all([is_generator for _, is_generator in phases])
+
+
+def test_phase_is_stable_when_called_again():
+    trainer = create_trainer(3, initial_generator_epochs=1, min_generator_steps=1, min_discriminator_steps=1)
+    assert trainer.should_train_generator(0, 4)
+    # the trainer asks again during the same step, after the epoch changed
+    assert trainer.should_train_generator(1, 4)
+    assert trainer.should_train_generator(1, 5)
+    assert not trainer.should_train_generator(1, 9)
+    assert not trainer.should_train_generator(1, 11)
+
+
+def test_resumed_update_keeps_saved_phase():
+    # saved after the first 2 micro batches of a generator update that crossed the end of the initial generator epochs
+    trainer = create_trainer(3, initial_generator_epochs=1, min_generator_steps=1, min_discriminator_steps=1)
+    trainer.restore_update_phase({'global_step': 11, 'update_step': 3, 'update_generator': 1, 'micro_batch': 2})
+    # the epoch and update step alone would train the discriminator
+    assert not trainer.is_generator_update(1, 3)
+    assert trainer.should_train_generator(1, 11)
+    # the next update is chosen from the epoch again
+    assert trainer.should_train_generator(1, 12) == trainer.is_generator_update(1, 4)
+
+
+def test_update_phase_is_not_restored_between_updates():
+    trainer = create_trainer(3, initial_generator_epochs=1, min_generator_steps=1, min_discriminator_steps=1)
+    trainer.restore_update_phase({'global_step': 12, 'update_step': 3, 'update_generator': 1, 'micro_batch': 0})
+    assert trainer.update_phase is None
+    assert trainer.should_train_generator(1, 12) == trainer.is_generator_update(1, 4)
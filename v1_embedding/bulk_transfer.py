@@ -0,0 +1,123 @@
+import collections
+import datetime
+import itertools
+import multiprocessing
+import os
+import time
+import tensorflow as tf
+import yaml
+
+from v1_embedding.exported_model import ExportedModel
+from v1_embedding.logger import init_logger
+from v1_embedding.model_exporter import get_export_dir
+
+# the model of the current worker process
+worker_model = None
+
+
+def init_worker(export_dir, intra_op_threads, inter_op_threads):
+    global worker_model
+    session_config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                    inter_op_parallelism_threads=inter_op_threads)
+    worker_model = ExportedModel(export_dir, session_config)
+
+
+def transfer_chunk(lines, batch_size):
+    return worker_model.transfer(lines, batch_size)
+
+
+class ProgressMarker:
+    # number of input lines that were transferred and the size of the output file when they were written
+    def __init__(self, output_file):
+        self.path = '{}.progress'.format(output_file)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0, 0
+        with open(self.path) as f:
+            progress = yaml.load(f)
+        return progress['lines'], progress['output_offset']
+
+    def save(self, lines, output_offset):
+        # write and rename so a crash never leaves a partial marker
+        temp_path = '{}.tmp'.format(self.path)
+        with open(temp_path, 'w') as f:
+            yaml.dump({'lines': lines, 'output_offset': output_offset}, f, default_flow_style=False)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_chunks(input_file, skip_lines, chunk_size):
+    with open(input_file) as f:
+        lines = itertools.islice(f, skip_lines, None)
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def bulk_transfer(export_dir, input_file, output_file, workers, batch_size, chunk_batches, intra_op_threads=0):
+    if intra_op_threads == 0:
+        # split the cores between the workers
+        intra_op_threads = max(1, multiprocessing.cpu_count() // workers)
+    progress_marker = ProgressMarker(output_file)
+    lines_done, output_offset = progress_marker.load()
+    if lines_done > 0 and os.path.exists(output_file):
+        # drop anything written after the last marker
+        os.truncate(output_file, output_offset)
+        print('resuming after {} lines'.format(lines_done))
+    else:
+        lines_done = 0
+        open(output_file, 'w').close()
+
+    start_time = time.time()
+    lines_at_start = lines_done
+    # spawn so each worker starts with a clean tensorflow runtime
+    pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker,
+                                                     initargs=(export_dir, intra_op_threads, 1))
+    with open(output_file, 'a') as f:
+        def write_next(pending):
+            # results are written in the order of the input
+            global_lines_done, result = pending.popleft()
+            f.writelines('{}\n'.format(s) for s in result.get())
+            f.flush()
+            os.fsync(f.fileno())
+            progress_marker.save(global_lines_done, f.tell())
+            print('transferred {} lines'.format(global_lines_done))
+
+        pending = collections.deque()
+        for chunk in read_chunks(input_file, lines_done, batch_size * chunk_batches):
+            lines_done += len(chunk)
+            pending.append((lines_done, pool.apply_async(transfer_chunk, (chunk, batch_size))))
+            # bound the number of chunks in memory
+            if len(pending) >= 2 * workers:
+                write_next(pending)
+        while pending:
+            write_next(pending)
+    pool.close()
+    pool.join()
+    progress_marker.remove()
+    elapsed = time.time() - start_time
+    print('transferred {} lines in {:.1f} seconds ({:.1f} lines/sec)'.format(
+        lines_done - lines_at_start, elapsed, (lines_done - lines_at_start) / max(elapsed, 1e-6)))
+
+
+if __name__ == "__main__":
+    name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    with open("config/gan.yml", 'r') as ymlfile:
+        config = yaml.load(ymlfile)
+    with open("config/operational.yml", 'r') as ymlfile:
+        operational_config = yaml.load(ymlfile)
+    init_logger(name)
+    bulk_config = operational_config['bulk_transfer']
+    bulk_transfer(get_export_dir(config),
+                  bulk_config['input_file'],
+                  bulk_config['output_file'],
+                  bulk_config['workers'],
+                  bulk_config['batch_size'],
+                  bulk_config['chunk_batches'],
+                  bulk_config['intra_op_threads'])
@@ -0,0 +1,77 @@
+import os
+import shutil
+import threading
+import time
+import tensorflow as tf
+
+from v1_embedding.exported_model import ExportedModel
+from v1_embedding.model_exporter import export_model
+
+
+class CheckpointWatcher:
+    # polls the saver directory, and when a new checkpoint appears exports it, loads it to a new session and passes
+    # the loaded model to on_new_model. everything happens on a background thread, the current model keeps serving.
+    # only the last keep_versions exports are kept, older ones are deleted once their models are closed
+    def __init__(self, config, embedding_handler, saver_dir, export_root, on_new_model, poll_seconds,
+                 current_checkpoint=None, transfer_cache=None, session_config=None, keep_versions=3):
+        self.config = config
+        self.embedding_handler = embedding_handler
+        self.saver_dir = saver_dir
+        self.export_root = export_root
+        self.on_new_model = on_new_model
+        self.poll_seconds = poll_seconds
+        self.current_checkpoint = current_checkpoint
+        self.transfer_cache = transfer_cache
+        self.session_config = session_config
+        self.keep_versions = keep_versions
+        # (export dir, model) from the oldest, the exports of previous runs have no model
+        self.versions = []
+        if os.path.exists(export_root):
+            self.versions = [(d, None) for d in sorted([os.path.join(export_root, d) for d in os.listdir(export_root)],
+                                                        key=os.path.getmtime)]
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='checkpoint_watcher')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def check_for_new_checkpoint(self):
+        checkpoint = tf.train.get_checkpoint_state(self.saver_dir)
+        if checkpoint is None or checkpoint.model_checkpoint_path == self.current_checkpoint:
+            return False
+        checkpoint_path = checkpoint.model_checkpoint_path
+        # every checkpoint is exported to its own directory so the served model is never overwritten
+        export_dir = os.path.join(self.export_root, os.path.basename(checkpoint_path))
+        export_model(self.config, self.embedding_handler, self.saver_dir, export_dir, checkpoint_path=checkpoint_path)
+        model = ExportedModel(export_dir, self.session_config, self.transfer_cache)
+        self.current_checkpoint = checkpoint_path
+        # an export of a previous run with the same checkpoint was overwritten
+        self.versions = [v for v in self.versions if v[0] != export_dir] + [(export_dir, model)]
+        self.on_new_model(model)
+        self.delete_old_versions()
+        return True
+
+    def delete_old_versions(self):
+        kept = []
+        for i, (export_dir, model) in enumerate(self.versions):
+            # a model that was not swapped out yet may still be serving
+            if i >= len(self.versions) - self.keep_versions or (model is not None and not model.closed):
+                kept.append((export_dir, model))
+            else:
+                shutil.rmtree(export_dir, ignore_errors=True)
+        self.versions = kept
+
+    def _run(self):
+        while not self.stop_event.wait(self.poll_seconds):
+            try:
+                # retries the versions that were still serving on the last check
+                self.delete_old_versions()
+                self.check_for_new_checkpoint()
+            except Exception as e:
+                # the checkpoint may still be written, try again on the next poll
+                print('failed to load new checkpoint: {}'.format(e))
@@ -31,3 +31,12 @@ class EmbeddingContainer(BaseModel):
                                          dtype=tf.int32)
         return self.embed_inputs(random_words)
 
+    def get_closest_words(self, embeddings):
+        with tf.variable_scope('{}/closest_words'.format(self.name)):
+            # (batch, time, embedding) => (batch, time) index of the closest vocabulary word using
+            # ||e - w||^2 = ||e||^2 - 2<e, w> + ||w||^2
+            embeddings_squared_norm = tf.reduce_sum(tf.square(embeddings), axis=-1, keep_dims=True)
+            vocabulary_squared_norm = tf.reduce_sum(tf.square(self.w), axis=-1)
+            dot_product = tf.tensordot(embeddings, self.w, axes=[[2], [1]])
+            distance = embeddings_squared_norm - 2.0 * dot_product + vocabulary_squared_norm
+            return tf.argmin(distance, axis=-1)
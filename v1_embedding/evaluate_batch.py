@@ -1,10 +1,12 @@
 import datetime
+import os
 import yaml
-import tensorflow as tf
 
-from v1_embedding.model_trainer import ModelTrainer
+from v1_embedding.exported_model import ExportedModel
 from v1_embedding.logger import init_logger
-from datasets.batch_iterator import BatchIterator
+from v1_embedding.model_exporter import get_export_dir, get_work_dir
+from v1_embedding.sampling_profiler import SamplingProfiler
+from v1_embedding.transfer_cache import TransferCache
 
 if __name__ == "__main__":
     name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -13,28 +15,28 @@ if __name__ == "__main__":
     with open("config/operational.yml", 'r') as ymlfile:
         operational_config = yaml.load(ymlfile)
     init_logger(name)
-    print('------------ Config ------------')
-    print(yaml.dump(config))
-    print('------------ Operational Config ------------')
-    print(yaml.dump(operational_config))
-    model_trainer = ModelTrainer(config, operational_config)
-    model = model_trainer.model
+    cache_config = operational_config['transfer_cache']
+    transfer_cache = TransferCache(cache_config['max_entries'], cache_config['max_megabytes'],
+                                   cache_config['disk_path']) if cache_config['enabled'] else None
+    # the model should be exported beforehand with model_exporter.py
+    model = ExportedModel(get_export_dir(config), transfer_cache=transfer_cache)
+
+    profiler = SamplingProfiler.from_config(os.path.join(get_work_dir(config), 'profiles'), operational_config)
 
     # read input file as list of sentences
     with open('input.txt') as f:
         content = f.readlines()
 
-    batch_iterator = BatchIterator(content, model.embedding_handler, config['sentence']['min_length'], 100,
-                                   shuffle_sentences=False)
     with open('output.txt', 'w') as f:
-        with tf.Session() as sess:
-            model_trainer.saver_wrapper.load_model(sess)
-            for b in batch_iterator:
-                new_batch = [b, b] # fake multi batch
-                _, _, original_source, transferred = model_trainer.transfer_batch(sess, new_batch)
-                for i in range(len(original_source)):
-                    print('original_source: {}'.format(original_source[i]))
-                    print('transferred: {}'.format(transferred[i]))
-                    f.write("{}\n".format(transferred[i]))
-
-
+        for batch_index, b in enumerate(model.get_batch_iterator(content, 100)):
+            profiler.update(batch_index)
+            original_source, transferred = model.transfer_batch(b)
+            for i in range(len(original_source)):
+                print('original_source: {}'.format(original_source[i]))
+                print('transferred: {}'.format(transferred[i]))
+                f.write("{}\n".format(transferred[i]))
+    profiler.stop()
+    model.close()
+    if transfer_cache is not None:
+        print('transfer cache: {}'.format(transfer_cache.get_stats()))
+        transfer_cache.close()
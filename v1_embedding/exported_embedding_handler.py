@@ -0,0 +1,29 @@
+import os
+from v1_embedding.embedding_handler import EmbeddingHandler
+
+
+class ExportedEmbeddingHandler(EmbeddingHandler):
+    # only the vocabulary of an exported model, the embedding itself is part of the exported graph
+    def __init__(self, export_dir):
+        EmbeddingHandler.__init__(self, export_dir)
+        if not self.initialized_from_cache:
+            raise Exception('vocabulary not found in: {}'.format(export_dir))
+        print('using {} unique words'.format(self.get_vocabulary_length()))
+
+    def load_files(self):
+        vocabulary_path = ExportedEmbeddingHandler.get_vocabulary_file_name(self.save_directory)
+        if not os.path.exists(vocabulary_path):
+            return False
+        with open(vocabulary_path) as f:
+            self.vocabulary_to_internals([w.rstrip('\n') for w in f])
+        return True
+
+    @staticmethod
+    def get_vocabulary_file_name(export_dir):
+        return os.path.join(export_dir, 'vocabulary.txt')
+
+    @staticmethod
+    def save_vocabulary(embedding_handler, export_dir):
+        with open(ExportedEmbeddingHandler.get_vocabulary_file_name(export_dir), 'w') as f:
+            for i in range(embedding_handler.get_vocabulary_length()):
+                f.write('{}\n'.format(embedding_handler.index_to_word[i]))
@@ -0,0 +1,79 @@
+import os
+import tensorflow as tf
+import yaml
+
+from datasets.batch import Batch
+from datasets.batch_iterator import BatchIterator
+from v1_embedding.exported_embedding_handler import ExportedEmbeddingHandler
+
+
+class ExportedModel:
+    def __init__(self, export_dir, session_config=None, transfer_cache=None):
+        self.export_dir = export_dir
+        self.transfer_cache = transfer_cache
+        self.closed = False
+        with open(os.path.join(export_dir, 'inference.yml'), 'r') as ymlfile:
+            self.inference_config = yaml.load(ymlfile)
+        self.sentence_length = self.inference_config['sentence_length']
+        self.checkpoint = self.inference_config['checkpoint']
+        self.embedding_handler = ExportedEmbeddingHandler(export_dir)
+        self.end_of_sentence_index = self.embedding_handler.word_to_index[self.embedding_handler.end_of_sentence_token]
+
+        self.graph = tf.Graph()
+        self.sess = tf.Session(graph=self.graph, config=session_config)
+        meta_graph = tf.saved_model.loader.load(self.sess, [tf.saved_model.tag_constants.SERVING], export_dir)
+        signature = meta_graph.signature_def[tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+        self.source_batch = self.graph.get_tensor_by_name(signature.inputs['source_batch'].name)
+        self.source_lengths = self.graph.get_tensor_by_name(signature.inputs['source_lengths'].name)
+        self.transferred = self.graph.get_tensor_by_name(signature.outputs['transferred'].name)
+        print('Model loaded from: {} (checkpoint {})\n'.format(export_dir, self.checkpoint))
+
+    def get_batch_iterator(self, content, batch_size):
+        return BatchIterator(content, self.embedding_handler, self.sentence_length, batch_size,
+                             shuffle_sentences=False)
+
+    def transfer_batch(self, batch):
+        # original source without paddings:
+        original_source = [s[:l] for s, l in zip(batch.sentences, batch.lengths)]
+        if self.transfer_cache is None:
+            return self.translate_to_string(original_source), self._run_batch(batch)
+        transferred = [self.transfer_cache.get(self.checkpoint, s) for s in original_source]
+        # only run the sentences that are not cached
+        missing = [i for i, t in enumerate(transferred) if t is None]
+        if len(missing) > 0:
+            missing_batch = Batch()
+            for i in missing:
+                missing_batch.add(batch.sentences[i], batch.lengths[i])
+            for i, t in zip(missing, self._run_batch(missing_batch)):
+                transferred[i] = t
+                self.transfer_cache.put(self.checkpoint, original_source[i], t)
+            self.transfer_cache.commit()
+        return self.translate_to_string(original_source), transferred
+
+    def _run_batch(self, batch):
+        transferred_result = self.sess.run(self.transferred, {
+            self.source_batch: batch.sentences,
+            self.source_lengths: batch.lengths,
+        })
+        # only take the prefix before EOS:
+        transferred = []
+        for s in transferred_result:
+            s = s.tolist()
+            if self.end_of_sentence_index in s:
+                s = s[:s.index(self.end_of_sentence_index) + 1]
+            transferred.append(s)
+        return self.translate_to_string(transferred)
+
+    def transfer(self, content, batch_size=100):
+        transferred = []
+        for batch in self.get_batch_iterator(content, batch_size):
+            transferred.extend(self.transfer_batch(batch)[1])
+        return transferred
+
+    def translate_to_string(self, indices):
+        return [' '.join(s) for s in self.embedding_handler.get_index_to_word(indices)]
+
+    def close(self):
+        # the transfer cache may be shared between models, it is closed by its owner
+        self.sess.close()
+        self.closed = True
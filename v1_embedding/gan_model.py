@@ -19,11 +19,22 @@ from v1_embedding.tf_counter import TfCounter
 
 
 class GanModel:
-    def __init__(self, config_file, operational_config_file, embedding_handler):
+    def __init__(self, config_file, operational_config_file, embedding_handler, num_replicas=1):
         self.config = config_file
         self.operational_config = operational_config_file
         self.do_tensorboard = operational_config_file['tensorboard_frequency'] > 0
         self.embedding_handler = embedding_handler
+        # number of data parallel replicas of the model
+        self.towers = self.config['trainer']['towers']
+        # number of worker processes that train the model together (between graph replication)
+        self.num_replicas = num_replicas
+        self.sync_optimizers = []
+        if self.num_replicas > 1 and self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+            raise Exception('reusing generator outputs is not supported with multiple replicas')
+        # number of micro batches whose gradients are summed before every update
+        self.accumulation_steps = self.config['trainer']['accumulation_steps']
+        if self.accumulation_steps > 1 and self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+            raise Exception('reusing generator outputs is not supported with gradient accumulation')
 
         # placeholders for dropouts
         self.dropout_placeholder = tf.placeholder(tf.float32, shape=(), name='dropout_placeholder')
@@ -60,23 +71,63 @@ class GanModel:
         self.policy = IterativePolicy(True, generator_steps=self.config['trainer']['min_generator_steps'],
                                       discriminator_steps=self.config['trainer']['min_discriminator_steps'])
 
-        # common steps:
-        self._source_embedding, self._source_encoded = self._encode(self.source_batch, self.source_lengths)
-        self._target_embedding, self._target_encoded = self._encode(self.target_batch, self.target_lengths)
-        self.transferred_source_batch = self.decoder.do_iterative_decoding(self._source_encoded)
-        self.reconstructed_targets_batch = self.decoder.do_teacher_forcing(
-            self._target_encoded, self._target_embedding[:, :-1, :], self.target_lengths
-        )
+        # common steps, built once per tower. the towers share the variables and each one gets a part of the batch
+        source_parts = self._split_to_towers([self.source_batch, self.source_lengths])
+        target_parts = self._split_to_towers([self.target_batch, self.target_lengths])
+        # the share of the batch of every tower, the losses and gradients of the towers are weighted by it
+        self._tower_weights = self._get_tower_weights(self.source_batch)
+        self._towers = []
+        for i in range(self.towers):
+            with tf.device(self._get_tower_device(i)):
+                self._towers.append(self._build_tower(source_parts[i][0], source_parts[i][1],
+                                                      target_parts[i][0], target_parts[i][1]))
+        self._source_encoded = self._combine_towers('source_encoded', tf.concat)
+        self._target_encoded = self._combine_towers('target_encoded', tf.concat)
+        self.transferred_source_batch = self._combine_towers('transferred', tf.concat)
+        self.reconstructed_targets_batch = self._combine_towers('reconstructed', tf.concat)
 
         # discriminator prediction
-        self.prediction, self._source_prediction, self._target_prediction = self._predict()
+        self.prediction = self._combine_towers('prediction', tf.concat)
 
         # discriminator loss and accuracy
-        self.discriminator_loss, self.accuracy = self.loss_handler.get_discriminator_loss_wasserstien(
-            self._source_prediction, self._target_prediction)
+        self.discriminator_loss = self._combine_towers('discriminator_loss', tf.reduce_mean)
+        self.accuracy = self._combine_towers('accuracy', tf.reduce_mean)
+
+        # discriminator steps that are fed with generator outputs computed beforehand, the generator weights do not
+        # change between consecutive discriminator steps so the encoder and decoders do not need to run each time
+        embedding_size = self.embedding_handler.get_embedding_size()
+        encoded_size = self.config['model']['encoder_hidden_states'][-1]
+        if self.config['model']['bidirectional_encoder']:
+            encoded_size *= 2
+        self.cached_transferred_source_batch = tf.placeholder(tf.float32, shape=(None, None, embedding_size),
+                                                              name='cached_transferred_source_batch')
+        self.cached_reconstructed_targets_batch = tf.placeholder(tf.float32, shape=(None, None, embedding_size),
+                                                                 name='cached_reconstructed_targets_batch')
+        self.cached_source_encoded = tf.placeholder(tf.float32, shape=(None, encoded_size),
+                                                    name='cached_source_encoded')
+        self.cached_target_encoded = tf.placeholder(tf.float32, shape=(None, encoded_size),
+                                                    name='cached_target_encoded')
+        # the generator outputs to compute and the placeholders to feed them to (in the same order)
+        self.generator_outputs = [self.transferred_source_batch, self.reconstructed_targets_batch,
+                                  self._source_encoded, self._target_encoded]
+        self.cached_generator_outputs_placeholders = [self.cached_transferred_source_batch,
+                                                      self.cached_reconstructed_targets_batch,
+                                                      self.cached_source_encoded, self.cached_target_encoded]
+        cached_parts = self._split_to_towers(self.cached_generator_outputs_placeholders)
+        self._cached_tower_weights = self._get_tower_weights(self.cached_transferred_source_batch)
+        cached_discriminator_losses, cached_accuracies = [], []
+        for i in range(self.towers):
+            with tf.device(self._get_tower_device(i)):
+                _, cached_source_prediction, cached_target_prediction = self._predict(*cached_parts[i])
+                cached_discriminator_loss, cached_accuracy = self.loss_handler.get_discriminator_loss_wasserstien(
+                    cached_source_prediction, cached_target_prediction)
+            cached_discriminator_losses.append(cached_discriminator_loss)
+            cached_accuracies.append(cached_accuracy)
+        self.cached_discriminator_loss = self._average(cached_discriminator_losses, self._cached_tower_weights)
+        self.cached_accuracy = self._average(cached_accuracies, self._cached_tower_weights)
 
         # target reconstruction loss
-        self.reconstruction_loss = self._get_reconstruction_loss()
+        self.reconstruction_loss = self._combine_towers('reconstruction_loss', tf.reduce_mean)
 
         # generator loss
         # flag indicating if we are starting with just generator training
@@ -90,34 +141,58 @@ class GanModel:
             false_fn=lambda: tf.greater_equal(self.accuracy, self.config['model']['minimal_accuracy_for_discriminator'])
         )
 
-        self.generator_loss = self.reconstruction_loss + tf.cond(
-            pred=self._apply_discriminator_loss_for_generator,
-            true_fn=lambda: -self.config['model']['discriminator_coefficient'] * self.discriminator_loss,
-            false_fn=lambda: 0.0
-        )
+        generator_losses = [
+            tower['reconstruction_loss'] + tf.cond(
+                pred=self._apply_discriminator_loss_for_generator,
+                true_fn=lambda: -self.config['model']['discriminator_coefficient'] * tower['discriminator_loss'],
+                false_fn=lambda: 0.0
+            ) for tower in self._towers
+        ]
+        self.generator_loss = self._average(generator_losses, self._tower_weights)
 
         # train steps
+        self._discriminator_optimizer, self._discriminator_global_step = None, None
+        self.cached_discriminator_train_step = None
+        # with gradient accumulation, the steps that only add the gradients of a micro batch
+        self.discriminator_accumulate_step, self.generator_accumulate_step = None, None
+        # compute the gradients of the train steps without applying them (to trace the model that is not trained)
+        self.cached_discriminator_gradients_step = None
         with tf.variable_scope('TrainSteps'):
+            # the counters are raised with the train steps that apply an update, the steps that only accumulate or
+            # compute gradients do not change them
+            # discriminator step
+            self.discriminator_train_step, self.discriminator_accumulate_step, \
+                self.discriminator_gradients_step = self._get_discriminator_train_step(
+                    [tower['discriminator_loss'] for tower in self._towers])
             # raise total steps counter
-            with tf.control_dependencies([self.total_steps_counter.update]):
-                # discriminator step
-                self.discriminator_train_step = self._get_discriminator_train_step()
-                with tf.control_dependencies([
-                    # raise generator steps counter
-                    self.generator_steps_counter.update,
-                    # see if we should increase the apply discriminator counter
-                    self.apply_discriminator_loss_for_generator_counter.increase_if(
-                        self._apply_discriminator_loss_for_generator)
-                ]):
-                    # generator train step
-                    self.generator_train_step = self._get_generator_train_step()
+            self.discriminator_train_step = tf.group(self.discriminator_train_step, self.total_steps_counter.update)
+            if self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+                # discriminator step on cached generator outputs
+                self.cached_discriminator_train_step, _, self.cached_discriminator_gradients_step = \
+                    self._get_discriminator_train_step(cached_discriminator_losses, cached=True)
+                self.cached_discriminator_train_step = tf.group(self.cached_discriminator_train_step,
+                                                                self.total_steps_counter.update)
+            # generator train step
+            self.generator_train_step, self.generator_accumulate_step, self.generator_gradients_step = \
+                self._get_generator_train_step(generator_losses)
+            self.generator_train_step = tf.group(
+                self.generator_train_step,
+                self.total_steps_counter.update,
+                # raise generator steps counter
+                self.generator_steps_counter.update,
+                # see if we should increase the apply discriminator counter
+                self.apply_discriminator_loss_for_generator_counter.increase_if(
+                    self._apply_discriminator_loss_for_generator)
+            )
 
         # init steps to None in case tensorboard is not used
         self.discriminator_step_summaries, self.generator_step_summaries = None, None
+        self.cached_discriminator_step_summaries = None
         self.text_watcher, self.evaluation_summary = None, None
         if self.do_tensorboard:
             # summaries
-            self.discriminator_step_summaries, self.generator_step_summaries = self._create_summaries()
+            self.discriminator_step_summaries, self.generator_step_summaries, \
+                self.cached_discriminator_step_summaries = self._create_summaries()
             # to generate text in tensorboard use:
             self.text_watcher = TextWatcher(['original_source', 'original_target', 'transferred', 'reconstructed'])
             self.evaluation_summary = self.text_watcher.summary
@@ -147,76 +222,249 @@ class GanModel:
         if self.config['model']['optimizer'] == 'rmsp':
             return tf.train.RMSPropOptimizer(learn_rate)
 
+    def _get_tower_device(self, tower_index):
+        # with a single tower the placement is left to tensorflow
+        if self.towers == 1:
+            return None
+        return '/cpu:{}'.format(tower_index)
+
+    def _split_to_towers(self, tensors):
+        # splits each of the tensors on the batch axis, returns the parts of every tower. a batch smaller than the
+        # number of towers leaves some towers empty, their weight is 0
+        if self.towers == 1:
+            return [tensors]
+        batch_size = tf.shape(tensors[0])[0]
+        bounds = [batch_size * i // self.towers for i in range(self.towers + 1)]
+        return [[t[bounds[i]:bounds[i + 1]] for t in tensors] for i in range(self.towers)]
+
+    def _get_tower_weights(self, tensor):
+        if self.towers == 1:
+            return [tf.constant(1.0)]
+        batch_size = tf.shape(tensor)[0]
+        bounds = [batch_size * i // self.towers for i in range(self.towers + 1)]
+        return [tf.cast(bounds[i + 1] - bounds[i], tf.float32) / tf.cast(batch_size, tf.float32)
+                for i in range(self.towers)]
+
+    @staticmethod
+    def _weight(value, weight):
+        # the values of an empty tower are nan (a mean over no sentences), they are replaced instead of multiplied by 0
+        return tf.where(tf.greater(weight, 0.0), value * weight, tf.zeros_like(value))
+
+    def _combine_towers(self, name, combine_function):
+        if self.towers == 1:
+            return self._towers[0][name]
+        values = [tower[name] for tower in self._towers]
+        if combine_function == tf.concat:
+            return tf.concat(values, axis=0)
+        # tf.reduce_mean, weighted by the share of the batch of every tower
+        return self._average(values, self._tower_weights)
+
+    def _average(self, values, weights):
+        if len(values) == 1:
+            return values[0]
+        return tf.add_n([GanModel._weight(value, weight) for value, weight in zip(values, weights)])
+
+    def _build_tower(self, source_batch, source_lengths, target_batch, target_lengths):
+        source_embedding, source_encoded = self._encode(source_batch, source_lengths)
+        target_embedding, target_encoded = self._encode(target_batch, target_lengths)
+        transferred = self.decoder.do_iterative_decoding(source_encoded)
+        reconstructed = self.decoder.do_teacher_forcing(target_encoded, target_embedding[:, :-1, :], target_lengths)
+        prediction, source_prediction, target_prediction = self._predict(
+            transferred, reconstructed, source_encoded, target_encoded
+        )
+        discriminator_loss, accuracy = self.loss_handler.get_discriminator_loss_wasserstien(
+            source_prediction, target_prediction)
+        return {
+            'source_encoded': source_encoded,
+            'target_encoded': target_encoded,
+            'transferred': transferred,
+            'reconstructed': reconstructed,
+            'prediction': prediction,
+            'discriminator_loss': discriminator_loss,
+            'accuracy': accuracy,
+            'reconstruction_loss': self._get_reconstruction_loss(target_batch, target_embedding, reconstructed),
+        }
+
+    def _compute_average_gradients(self, optimizer, losses, var_list, weights):
+        # the gradients of every tower loss, averaged over the towers by their share of the batch
+        towers_grads_and_vars = [
+            optimizer.compute_gradients(loss, colocate_gradients_with_ops=True, var_list=var_list) for loss in losses
+        ]
+        if len(towers_grads_and_vars) == 1:
+            return towers_grads_and_vars[0]
+        average_grads_and_vars = []
+        for grads_and_vars in zip(*towers_grads_and_vars):
+            var = grads_and_vars[0][1]
+            grads = [(g, weight) for (g, _), weight in zip(grads_and_vars, weights) if g is not None]
+            if len(grads) == 0:
+                average_grads_and_vars.append((None, var))
+            elif isinstance(grads[0][0], tf.IndexedSlices):
+                # sparse gradients (of the embedding) are averaged without making them dense
+                average_grads_and_vars.append((tf.IndexedSlices(
+                    tf.concat([GanModel._weight(g.values, weight) for g, weight in grads], axis=0),
+                    tf.concat([g.indices for g, _ in grads], axis=0),
+                    grads[0][0].dense_shape
+                ), var))
+            else:
+                average_grads_and_vars.append((tf.add_n([GanModel._weight(g, weight) for g, weight in grads]), var))
+        return average_grads_and_vars
+
+    def _accumulate_gradients(self, grads_and_vars):
+        # the gradients of the micro batches are summed in variables, only the accumulators are the size of the model
+        # while the activations are the size of a micro batch
+        accumulate_ops, accumulators = [], []
+        for grad, var in grads_and_vars:
+            if grad is None:
+                accumulators.append(None)
+                continue
+            accumulator = tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False,
+                                      name='{}_accumulator'.format(var.op.name.replace('/', '_')))
+            if isinstance(grad, tf.IndexedSlices):
+                accumulate_ops.append(tf.scatter_add(accumulator, grad.indices, grad.values))
+            else:
+                accumulate_ops.append(accumulator.assign_add(grad))
+            accumulators.append(accumulator)
+        accumulate_step = tf.group(*accumulate_ops)
+        # the update uses the mean gradient of the accumulated micro batches and the current one
+        average_grads_and_vars = []
+        with tf.control_dependencies([accumulate_step]):
+            for accumulator, (_, var) in zip(accumulators, grads_and_vars):
+                if accumulator is None:
+                    average_grads_and_vars.append((None, var))
+                else:
+                    average_grads_and_vars.append((accumulator.read_value() / self.accumulation_steps, var))
+        return accumulate_step, average_grads_and_vars, accumulators
+
+    @staticmethod
+    def _reset_accumulators(train_step, accumulators):
+        # the accumulators are zeroed only after the update read them
+        with tf.control_dependencies([train_step]):
+            return tf.group(*[
+                a.assign(tf.zeros(a.get_shape(), dtype=a.dtype.base_dtype)) for a in accumulators if a is not None
+            ])
+
+    def _get_train_optimizer(self, name):
+        optimizer = self._get_optimizer()
+        if self.num_replicas == 1:
+            return optimizer, None
+        # synchronous training: the gradients of all the replicas are aggregated before every update
+        optimizer = tf.train.SyncReplicasOptimizer(optimizer,
+                                                   replicas_to_aggregate=self.num_replicas,
+                                                   total_num_replicas=self.num_replicas)
+        global_step = tf.Variable(0, dtype=tf.int64, trainable=False, name='{}_global_step'.format(name))
+        self.sync_optimizers.append(optimizer)
+        return optimizer, global_step
+
     def _encode(self, inputs, input_lengths):
         embedding = self.embedding_container.embed_inputs(inputs)
         encoded = self.encoder.encode_inputs_to_vector(embedding, input_lengths)
         return embedding, encoded
 
-    def _predict(self):
+    def _predict(self, transferred_source_batch, reconstructed_targets_batch, source_encoded, target_encoded):
         if self.config['model']['discriminator_type'] == 'embedding':
-            sentence_length = tf.shape(self.reconstructed_targets_batch)[1]
-            transferred_source_normalized = self.transferred_source_batch[:, :sentence_length, :]
-            prediction_input = tf.concat((transferred_source_normalized, self.reconstructed_targets_batch), axis=0)
+            sentence_length = tf.shape(reconstructed_targets_batch)[1]
+            transferred_source_normalized = transferred_source_batch[:, :sentence_length, :]
+            prediction_input = tf.concat((transferred_source_normalized, reconstructed_targets_batch), axis=0)
             if self.config['discriminator_embedding']['include_content_vector']:
-                encoded = tf.concat((self._source_encoded, self._target_encoded), axis=0)
+                encoded = tf.concat((source_encoded, target_encoded), axis=0)
             else:
                 encoded = None
             prediction = self.discriminator.predict(prediction_input, encoded)
         if self.config['model']['discriminator_type'] == 'content':
-            prediction_input = tf.concat((self._source_encoded, self._target_encoded), axis=0)
+            prediction_input = tf.concat((source_encoded, target_encoded), axis=0)
             prediction = self.discriminator.predict(prediction_input)
-        source_batch_size = tf.shape(self.source_batch)[0]
+        source_batch_size = tf.shape(source_encoded)[0]
         source_prediction, target_prediction = tf.split(prediction, [source_batch_size, source_batch_size], axis=0)
         return prediction, source_prediction, target_prediction
 
-    def _get_reconstruction_loss(self):
+    def _get_reconstruction_loss(self, target_batch, target_embedding, reconstructed_targets_batch):
         vocabulary_length = self.embedding_handler.get_vocabulary_length()
         random_words = self.config['margin_loss2']['random_words_size']
-        padding_mask = tf.not_equal(self.target_batch, vocabulary_length)
+        padding_mask = tf.not_equal(target_batch, vocabulary_length)
         embedded_random_words = None
         if random_words > 0:
-            input_shape = tf.shape(self.target_batch)
-            embedded_random_words = self.embedding_container.get_random_words_embeddings(
-                shape=(input_shape[0], input_shape[1], random_words)
-            )
-        return self.loss_handler.get_margin_loss_v2(self._target_embedding, self.reconstructed_targets_batch,
+            if self.config['margin_loss2']['shared_random_words']:
+                # one pool of negative words for all the tokens in the batch
+                shape = (random_words,)
+            else:
+                input_shape = tf.shape(target_batch)
+                shape = (input_shape[0], input_shape[1], random_words)
+            embedded_random_words = self.embedding_container.get_random_words_embeddings(shape=shape)
+        return self.loss_handler.get_margin_loss_v2(target_embedding, reconstructed_targets_batch,
                                                     embedded_random_words, padding_mask,
                                                     self.config['margin_loss2']['margin'])
 
-    def _get_discriminator_train_step(self):
-        # the embedding discriminator has batch norm that we need to update
+    def _get_discriminator_train_step(self, discriminator_losses, cached=False):
+        # the update ops of the embedding discriminator (batch norm statistics, if it has any) are created by the
+        # discriminator that runs on the generator, the cached step is fed the generator outputs and does not run them
         update_ops = None
-        if self.config['model']['discriminator_type'] == 'embedding':
+        if self.config['model']['discriminator_type'] == 'embedding' and not cached:
             update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
 
         with tf.variable_scope('TrainDiscriminatorSteps'):
-            discriminator_optimizer = self._get_optimizer()
+            # all the discriminator train steps share the same optimizer (and slot variables)
+            if self._discriminator_optimizer is None:
+                self._discriminator_optimizer, self._discriminator_global_step = self._get_train_optimizer(
+                    'discriminator')
+            discriminator_optimizer = self._discriminator_optimizer
             discriminator_var_list = self.discriminator.get_trainable_parameters()
 
-            discriminator_grads_and_vars = discriminator_optimizer.compute_gradients(
-                self.discriminator_loss, colocate_gradients_with_ops=True, var_list=discriminator_var_list
+            discriminator_grads_and_vars = self._compute_average_gradients(
+                discriminator_optimizer, discriminator_losses, discriminator_var_list,
+                self._cached_tower_weights if cached else self._tower_weights
             )
+            gradients_step = self._get_gradients_step(discriminator_grads_and_vars)
+            accumulate_step, accumulators = None, None
+            if self.accumulation_steps > 1:
+                # the batch norm statistics are updated by every micro batch
+                with tf.control_dependencies(update_ops or []):
+                    accumulate_step, discriminator_grads_and_vars, accumulators = self._accumulate_gradients(
+                        discriminator_grads_and_vars)
             if update_ops is None:
-                discriminator_train_step = discriminator_optimizer.apply_gradients(discriminator_grads_and_vars)
+                discriminator_train_step = discriminator_optimizer.apply_gradients(
+                    discriminator_grads_and_vars, global_step=self._discriminator_global_step)
             else:
                 with tf.control_dependencies(update_ops):
-                    discriminator_train_step = discriminator_optimizer.apply_gradients(discriminator_grads_and_vars)
+                    discriminator_train_step = discriminator_optimizer.apply_gradients(
+                        discriminator_grads_and_vars, global_step=self._discriminator_global_step)
+            # the weights are read for clipping only after the update was applied. with multiple replicas the train step
+            # returns once the aggregated update was applied, so every replica clips the updated shared weights before
+            # computing its next gradients (clipping twice changes nothing)
             clip_val = self.config['wasserstein_loss']['clip_value']
-            clip_discriminator = [p.assign(tf.clip_by_value(p, -clip_val, clip_val)) for p in discriminator_var_list]
             with tf.control_dependencies([discriminator_train_step]):
-                return tf.group(*clip_discriminator)
+                discriminator_train_step = tf.group(*[
+                    p.assign(tf.clip_by_value(p.read_value(), -clip_val, clip_val)) for p in discriminator_var_list
+                ])
+            if accumulators is not None:
+                discriminator_train_step = GanModel._reset_accumulators(discriminator_train_step, accumulators)
+            return discriminator_train_step, accumulate_step, gradients_step
 
-    def _get_generator_train_step(self):
+    def _get_generator_train_step(self, generator_losses):
         with tf.variable_scope('TrainGeneratorSteps'):
-            generator_optimizer = self._get_optimizer()
+            generator_optimizer, generator_global_step = self._get_train_optimizer('generator')
             generator_var_list = self.encoder.get_trainable_parameters() + self.decoder.get_trainable_parameters() + \
                                  self.embedding_container.get_trainable_parameters()
-            generator_grads_and_vars = generator_optimizer.compute_gradients(
-                self.generator_loss,
-                colocate_gradients_with_ops=True,
-                var_list=generator_var_list
+            generator_grads_and_vars = self._compute_average_gradients(
+                generator_optimizer, generator_losses, generator_var_list, self._tower_weights
             )
-            return generator_optimizer.apply_gradients(generator_grads_and_vars)
+            gradients_step = self._get_gradients_step(generator_grads_and_vars)
+            accumulate_step, accumulators = None, None
+            if self.accumulation_steps > 1:
+                accumulate_step, generator_grads_and_vars, accumulators = self._accumulate_gradients(
+                    generator_grads_and_vars)
+            generator_train_step = generator_optimizer.apply_gradients(generator_grads_and_vars,
+                                                                       global_step=generator_global_step)
+            if accumulators is not None:
+                generator_train_step = GanModel._reset_accumulators(generator_train_step, accumulators)
+            return generator_train_step, accumulate_step, gradients_step
+
+    @staticmethod
+    def _get_gradients_step(grads_and_vars):
+        # built outside of the counter updates (they are grouped with the applying train steps), so running it changes
+        # no variables
+        return tf.group(*[
+            grad.values if isinstance(grad, tf.IndexedSlices) else grad for grad, _ in grads_and_vars if grad is not None
+        ])
 
     def _create_ratio_summary(self, nominator, denominator):
         return tf.cond(
@@ -240,6 +488,13 @@ class GanModel:
             accuracy_summary,
             discriminator_loss_summary,
         ])
+        with tf.name_scope('cached_generator_outputs'):
+            cached_discriminator_step_summaries = tf.summary.merge([
+                epoch_summary,
+                train_generator_summary,
+                tf.summary.scalar('accuracy', self.cached_accuracy),
+                tf.summary.scalar('discriminator_loss', self.cached_discriminator_loss),
+            ])
         generator_step_summaries = tf.summary.merge([
             epoch_summary,
             train_generator_summary,
@@ -255,6 +510,6 @@ class GanModel:
                                            self.generator_steps_counter.count)
             )
         ])
-        return discriminator_step_summaries, generator_step_summaries
+        return discriminator_step_summaries, generator_step_summaries, cached_discriminator_step_summaries
 
 
@@ -0,0 +1,41 @@
+import tensorflow as tf
+
+from v1_embedding.embedding_container import EmbeddingContainer
+from v1_embedding.embedding_decoder import EmbeddingDecoder
+from v1_embedding.embedding_encoder import EmbeddingEncoder
+
+
+# only the parts of GanModel needed to transfer source sentences: embedding, encoder, iterative decoder and decoding
+# back to word indices. the components are created in the same order as in GanModel so the variable names match the
+# ones in the training checkpoints
+
+
+class InferenceModel:
+    def __init__(self, config_file, embedding_handler):
+        self.config = config_file
+        self.embedding_handler = embedding_handler
+
+        # dropout is never used in inference
+        self.dropout_placeholder = tf.placeholder_with_default(0.0, shape=(), name='dropout_placeholder')
+        # placeholder for source sentences (batch, time)=> index of word s.t the padding is on the right
+        self.source_batch = tf.placeholder(tf.int64, shape=(None, None), name='source_batch')
+        self.source_lengths = tf.placeholder(tf.int32, shape=(None), name='source_lengths')
+
+        self.embedding_container = EmbeddingContainer(self.embedding_handler, False)
+        self.encoder = EmbeddingEncoder(self.config['model']['encoder_hidden_states'],
+                                        self.dropout_placeholder,
+                                        self.config['model']['bidirectional_encoder'],
+                                        self.config['model']['cell_type'])
+        self.decoder = EmbeddingDecoder(self.embedding_handler.get_embedding_size(),
+                                        self.config['model']['decoder_hidden_states'],
+                                        self.dropout_placeholder,
+                                        self.config['sentence']['min_length'],
+                                        self.config['model']['cell_type'])
+
+        source_embedding = self.embedding_container.embed_inputs(self.source_batch)
+        source_encoded = self.encoder.encode_inputs_to_vector(source_embedding, self.source_lengths)
+        self.transferred_source_batch = self.decoder.do_iterative_decoding(source_encoded)
+        self.transferred_source_indices = tf.identity(
+            self.embedding_container.get_closest_words(self.transferred_source_batch),
+            name='transferred_source_indices'
+        )
@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import yaml
+
+
+def start_task(job_name, task_index):
+    return subprocess.Popen([sys.executable, '-m', 'v1_embedding.model_trainer', job_name, str(task_index)])
+
+
+if __name__ == "__main__":
+    # runs all the tasks of the cluster in the operational config on this machine
+    with open("config/operational.yml", 'r') as ymlfile:
+        operational_config = yaml.load(ymlfile)
+    cluster = operational_config['cluster']
+    if cluster is None:
+        raise Exception('no cluster in the operational config')
+    ps_processes = [start_task('ps', i) for i in range(len(cluster['ps']))]
+    worker_processes = [start_task('worker', i) for i in range(len(cluster['worker']))]
+    try:
+        for process in worker_processes:
+            process.wait()
+    finally:
+        # the parameter servers never exit by themselves
+        for process in ps_processes + worker_processes:
+            if process.poll() is None:
+                process.terminate()
@@ -1,15 +1,95 @@
+import atexit
 import datetime
+import json
+import queue
 import sys
 import os
+import threading
+import time
+
+
+class AsyncWriter:
+    # the writes are queued and a background thread writes them, so the callers never wait for I/O. every target is
+    # either a file name (kept open for appending) or a stream
+    _close = object()
+
+    def __init__(self, flush_seconds=1.0):
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue()
+        self.files = {}
+        self.thread = threading.Thread(target=self._write_loop, name='async_writer')
+        self.thread.daemon = True
+        self.thread.start()
+        # write whatever is queued when the process exits
+        atexit.register(self.close)
+
+    def write(self, target, text):
+        self.queue.put((target, text))
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self._close)
+            self.thread.join()
+
+    def _write_loop(self):
+        last_flush_time = time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = None
+            if item is self._close:
+                self._flush()
+                for f in self.files.values():
+                    f.close()
+                return
+            if item is not None:
+                target, text = item
+                try:
+                    self._get_stream(target).write(text)
+                except Exception as e:
+                    sys.__stderr__.write('failed to write to {}: {}\n'.format(target, e))
+            # flush once in a while instead of after every write
+            if time.time() - last_flush_time >= self.flush_seconds:
+                self._flush()
+                last_flush_time = time.time()
+
+    def _get_stream(self, target):
+        if not isinstance(target, str):
+            return target
+        if target not in self.files:
+            self.files[target] = open(target, 'a')
+        return self.files[target]
+
+    def _flush(self):
+        for stream in list(self.files.values()) + [sys.__stdout__]:
+            try:
+                stream.flush()
+            except Exception:
+                pass
+
+
+_async_writer = None
+
+
+def get_async_writer():
+    global _async_writer
+    if _async_writer is None:
+        _async_writer = AsyncWriter()
+    return _async_writer
+
 
 class MyLogger:
     def __init__(self, stdout, filename):
         self.stdout = stdout
-        self.logfile = open(filename, 'w')
+        self.filename = filename
+        # start a new log file
+        open(filename, 'w').close()
+        self.writer = get_async_writer()
 
     def write(self, text):
-        self.stdout.write(text)
-        self.logfile.write(text)
+        self.writer.write(self.stdout, text)
+        self.writer.write(self.filename, text)
 
     def close(self):
         pass
@@ -17,7 +97,20 @@ class MyLogger:
         # self.logfile.close()
 
     def flush(self):
-        self.logfile.flush()
+        # the writer flushes by itself
+        pass
+
+
+class MetricsStream:
+    # one json object per line, for dashboards to ingest
+    def __init__(self, filename):
+        self.filename = filename
+        self.writer = get_async_writer()
+
+    def write(self, values):
+        values = dict(values)
+        values['time'] = time.time()
+        self.writer.write(self.filename, json.dumps(values, sort_keys=True) + '\n')
 
 
 def init_logger(name):
@@ -3,6 +3,7 @@ from v1_embedding.base_model import BaseModel
 
 
 class LossHandler(BaseModel):
+    squared_distance_epsilon = 1e-12
 
     def __init__(self, vocabulary_length):
         BaseModel.__init__(self)
@@ -12,17 +13,11 @@ class LossHandler(BaseModel):
         per_word_distance = tf.sqrt(tf.reduce_sum(tf.squared_difference(true_embeddings, decoded_embeddings), axis=-1))
 
         if random_words_embeddings is not None:
-            len_random_words = tf.shape(random_words_embeddings)[2]
-
-            sq_difference_expand = tf.expand_dims(per_word_distance, 2)
-            sq_difference_expand = tf.tile(sq_difference_expand, [1, 1, len_random_words])
-
-            target_expand = tf.expand_dims(decoded_embeddings, 2)
-            target_expand = tf.tile(target_expand, [1, 1, len_random_words, 1])
-            per_random_word_distance = tf.sqrt(
-                tf.reduce_sum(tf.squared_difference(target_expand, random_words_embeddings), axis=-1))
-
-            per_word_margin_loss = tf.maximum(0.0, margin + sq_difference_expand - per_random_word_distance)
+            # (batch, time, random_words)
+            per_random_word_distance = self.get_distance_to_random_words(decoded_embeddings, random_words_embeddings)
+            per_word_margin_loss = tf.maximum(
+                0.0, margin + tf.expand_dims(per_word_distance, 2) - per_random_word_distance
+            )
             per_word_distance = tf.reduce_mean(per_word_margin_loss, axis=-1)
 
         mask = tf.where(padding_mask, tf.ones_like(padding_mask, dtype=tf.float32),
@@ -32,6 +27,24 @@ class LossHandler(BaseModel):
 
         return sum / mask_sum
 
+    @staticmethod
+    def get_distance_to_random_words(decoded_embeddings, random_words_embeddings):
+        # uses ||x - r||^2 = ||x||^2 - 2<x, r> + ||r||^2 so the decoded embeddings are never tiled to
+        # (batch, time, random_words, embedding).
+        # random_words_embeddings is either (batch, time, random_words, embedding) - words per token, or
+        # (random_words, embedding) - a single pool of words shared by the whole batch
+        decoded_squared_norm = tf.reduce_sum(tf.square(decoded_embeddings), axis=-1, keep_dims=True)
+        random_words_squared_norm = tf.reduce_sum(tf.square(random_words_embeddings), axis=-1)
+        if random_words_embeddings.get_shape().ndims == 2:
+            dot_product = tf.tensordot(decoded_embeddings, random_words_embeddings, axes=[[2], [1]])
+        else:
+            dot_product = tf.squeeze(tf.matmul(random_words_embeddings, tf.expand_dims(decoded_embeddings, -1)),
+                                     axis=-1)
+        squared_distance = decoded_squared_norm - 2.0 * dot_product + random_words_squared_norm
+        # the cancellation of the expanded form gives zero or negative values for close words, where the gradient of the
+        # sqrt is not finite. distances below sqrt(epsilon) are not exact (the loss differs slightly from the tiled one)
+        return tf.sqrt(tf.maximum(squared_distance, LossHandler.squared_distance_epsilon))
+
     def get_discriminator_loss_wasserstien(self, prediction_transferred, prediction_target):
         with tf.variable_scope('DiscriminatorLoss'):
             transferred_accuracy = tf.reduce_mean(tf.cast(tf.less(prediction_transferred, 0.0), tf.float32))
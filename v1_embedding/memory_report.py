@@ -0,0 +1,99 @@
+import collections
+import resource
+import sys
+import tracemalloc
+import tensorflow as tf
+
+MEGABYTE = 1024.0 * 1024.0
+
+
+class MemoryReport:
+    # the memory of the process after every phase of the trainer, the size of the cached python structures and the
+    # tensorflow allocations of traced train steps
+    def __init__(self, trace_python_heap=False, top_scopes=10):
+        self.trace_python_heap = trace_python_heap
+        self.top_scopes = top_scopes
+        if trace_python_heap and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # phase => memory of the process after it
+        self.phases = collections.OrderedDict()
+
+    def get_process_memory(self):
+        res = {
+            # ru_maxrss is in kilobytes on linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        }
+        try:
+            with open('/proc/self/statm') as f:
+                res['rss_mb'] = int(f.read().split()[1]) * resource.getpagesize() / MEGABYTE
+        except IOError:
+            pass
+        if self.trace_python_heap:
+            current, peak = tracemalloc.get_traced_memory()
+            res['python_heap_mb'] = current / MEGABYTE
+            res['python_heap_peak_mb'] = peak / MEGABYTE
+        return res
+
+    def record_phase(self, phase):
+        self.phases[phase] = self.get_process_memory()
+        print('memory after {}: {}'.format(phase, MemoryReport.format_values(self.phases[phase])))
+
+    @staticmethod
+    def get_structure_sizes(datasets, embedding_handler):
+        # datasets is a dictionary of name => dataset
+        res = {}
+        for name, dataset in datasets.items():
+            content = dataset.content or []
+            res['dataset_{}_content_mb'.format(name)] = \
+                (sys.getsizeof(content) + sum([sys.getsizeof(s) for s in content])) / MEGABYTE
+        res['embedding_np_mb'] = embedding_handler.embedding_np.nbytes / MEGABYTE
+        for name in ['word_to_index', 'index_to_word']:
+            mapping = getattr(embedding_handler, name)
+            res['{}_mb'.format(name)] = (sys.getsizeof(mapping) + sum(
+                [sys.getsizeof(k) + sys.getsizeof(v) for k, v in mapping.items()]
+            )) / MEGABYTE
+        return res
+
+    def get_step_memory(self, run_metadata):
+        # the bytes allocated by every node of the step, summed by the top level name scopes
+        scope_bytes = collections.Counter()
+        allocator_peaks = collections.Counter()
+        largest_node, largest_node_bytes = None, 0
+        persistent_bytes = 0
+        for device_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in device_stats.node_stats:
+                node_bytes = 0
+                for memory in node_stats.memory:
+                    node_bytes += memory.total_bytes
+                    allocator_peaks[memory.allocator_name] = max(allocator_peaks[memory.allocator_name],
+                                                                 memory.peak_bytes)
+                persistent_bytes += node_stats.memory_stats.persistent_memory_size
+                scope_bytes['/'.join(node_stats.node_name.split('/')[:2])] += node_bytes
+                if node_bytes > largest_node_bytes:
+                    largest_node, largest_node_bytes = node_stats.node_name, node_bytes
+        res = {
+            'allocated_mb': sum(scope_bytes.values()) / MEGABYTE,
+            'allocator_peak_mb': max(list(allocator_peaks.values()) + [0]) / MEGABYTE,
+            'persistent_mb': persistent_bytes / MEGABYTE,
+            'largest_node_mb': largest_node_bytes / MEGABYTE,
+        }
+        top_scopes = [(scope, b / MEGABYTE) for scope, b in scope_bytes.most_common(self.top_scopes)]
+        return res, largest_node, top_scopes
+
+    def report_step(self, step_name, run_metadata):
+        values, largest_node, top_scopes = self.get_step_memory(run_metadata)
+        print('memory of {} step: {} largest node: {}'.format(step_name, MemoryReport.format_values(values),
+                                                               largest_node))
+        print('memory of {} step by scope: {}'.format(
+            step_name, ', '.join(['{} {:.1f} MB'.format(scope, mb) for scope, mb in top_scopes])))
+        return {'{}_step_{}'.format(step_name, k): v for k, v in values.items()}
+
+    @staticmethod
+    def format_values(values):
+        return ' '.join(['{} {:.1f}'.format(k, values[k]) for k in sorted(values)])
+
+    @staticmethod
+    def get_summary(values):
+        return tf.Summary(value=[
+            tf.Summary.Value(tag='Memory/{}'.format(k), simple_value=values[k]) for k in sorted(values)
+        ])
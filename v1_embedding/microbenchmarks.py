@@ -0,0 +1,209 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+
+from datasets.batch_iterator import BatchIterator
+from datasets.multi_batch_iterator import MultiBatchIterator
+from v1_embedding.embedding_handler import EmbeddingHandler
+from v1_embedding.loss_handler import LossHandler
+from v1_embedding.model_trainer import ModelTrainer
+from v1_embedding.pre_trained_embedding_handler import PreTrainedEmbeddingHandler
+from v1_embedding.tower_scaling import create_synthetic_embedding_handler
+
+
+# benchmarks of the python and numpy hot paths on synthetic inputs. the inputs only depend on the parameters below and a
+# fixed seed, so the results of different commits on the same machine can be compared.
+# usage: python -m v1_embedding.microbenchmarks [output.json]
+#        python -m v1_embedding.microbenchmarks compare base.json new.json
+
+PARAMETERS = {
+    'seed': 0,
+    'vocabulary_size': 20000,
+    'embedding_size': 200,
+    'sentences': 20000,
+    'sentence_length': 15,
+    'batch_size': 100,
+    # translate_embeddings loops over the vocabulary, so it gets fewer sentences
+    'translate_sentences': 10,
+    'random_words': 5,
+    'repeats': 5,
+}
+
+
+def measure(function, items, repeats):
+    times = []
+    for _ in range(repeats):
+        start_time = time.time()
+        function()
+        times.append(time.time() - start_time)
+    return {
+        'items': items,
+        'min_seconds': min(times),
+        'median_seconds': float(np.median(times)),
+        # the minimum is the least affected by other processes
+        'items_per_second': items / min(times),
+    }
+
+
+def create_sentences(embedding_handler, parameters, random_state):
+    words = [embedding_handler.index_to_word[i] for i in range(2, embedding_handler.get_vocabulary_length())]
+    # a few words outside the vocabulary, like real text
+    words += ['oov{}'.format(i) for i in range(len(words) // 50)]
+    lengths = random_state.randint(parameters['sentence_length'] // 2, parameters['sentence_length'] + 5,
+                                   size=parameters['sentences'])
+    return [' '.join([words[w] for w in random_state.randint(0, len(words), size=l)]) for l in lengths]
+
+
+def benchmark_normalized_sentence(embedding_handler, sentences, parameters):
+    batch_iterator = BatchIterator(sentences, embedding_handler, parameters['sentence_length'],
+                                   parameters['batch_size'], shuffle_sentences=False)
+    return measure(lambda: [batch_iterator.normalized_sentence(s) for s in sentences], len(sentences),
+                   parameters['repeats'])
+
+
+def benchmark_multi_batch_iterator_epoch(embedding_handler, sentences, parameters):
+    contents = [sentences[:len(sentences) // 2], sentences[len(sentences) // 2:]]
+    multi_batch_iterator = MultiBatchIterator(contents, embedding_handler, parameters['sentence_length'],
+                                              parameters['batch_size'], seed=parameters['seed'])
+    return measure(lambda: list(multi_batch_iterator.get_epoch(0)), len(sentences), parameters['repeats'])
+
+
+def benchmark_word_to_index(embedding_handler, sentences, parameters):
+    tokenized = [s.split(' ') for s in sentences]
+    return measure(lambda: embedding_handler.get_word_to_index(tokenized), len(sentences), parameters['repeats'])
+
+
+def benchmark_index_to_word(embedding_handler, sentences, parameters):
+    indices = embedding_handler.get_word_to_index([s.split(' ') for s in sentences])
+    return measure(lambda: embedding_handler.get_index_to_word(indices), len(sentences), parameters['repeats'])
+
+
+def benchmark_load_from_files(embedding_handler, sentences, parameters):
+    # a pretrained embedding file with twice the vocabulary, half of it is filtered out while loading
+    save_dir = tempfile.mkdtemp()
+    try:
+        embedding_file = os.path.join(save_dir, 'embeddings.txt')
+        random_state = np.random.RandomState(parameters['seed'])
+        with open(embedding_file, 'w') as f:
+            for i in range(2 * embedding_handler.get_vocabulary_length()):
+                word = embedding_handler.index_to_word[i] if i < embedding_handler.get_vocabulary_length() else \
+                    'extra{}'.format(i)
+                vector = random_state.randn(parameters['embedding_size'])
+                f.write('{} {}\n'.format(word, ' '.join(['{:.6f}'.format(v) for v in vector])))
+        pretrained_embedding_handler = PreTrainedEmbeddingHandler.__new__(PreTrainedEmbeddingHandler)
+        EmbeddingHandler.__init__(pretrained_embedding_handler, save_dir)
+        pretrained_embedding_handler.pretrained_embedding_file = embedding_file
+        word_set = set(embedding_handler.word_to_index.keys())
+        return measure(lambda: pretrained_embedding_handler.load_from_files(word_set),
+                       2 * embedding_handler.get_vocabulary_length(), parameters['repeats'])
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+
+def benchmark_translate_embeddings(embedding_handler, sentences, parameters):
+    random_state = np.random.RandomState(parameters['seed'])
+    embeddings = random_state.randn(parameters['translate_sentences'], parameters['sentence_length'],
+                                    parameters['embedding_size']).astype(np.float32)
+    # translate_embeddings only uses the embedding handler of the trainer
+    trainer = ModelTrainer.__new__(ModelTrainer)
+    trainer.embedding_handler = embedding_handler
+    return measure(lambda: trainer.translate_embeddings(embeddings), parameters['translate_sentences'],
+                   parameters['repeats'])
+
+
+def benchmark_margin_loss(embedding_handler, sentences, parameters):
+    random_state = np.random.RandomState(parameters['seed'])
+    shape = (parameters['batch_size'], parameters['sentence_length'], parameters['embedding_size'])
+    random_words_shape = (parameters['batch_size'], parameters['sentence_length'], parameters['random_words'],
+                          parameters['embedding_size'])
+    graph = tf.Graph()
+    with graph.as_default():
+        true_embeddings = tf.constant(random_state.randn(*shape).astype(np.float32))
+        decoded_embeddings = tf.Variable(random_state.randn(*shape).astype(np.float32))
+        random_words_embeddings = tf.constant(random_state.randn(*random_words_shape).astype(np.float32))
+        padding_mask = tf.constant(random_state.rand(*shape[:2]) < 0.8)
+        loss = LossHandler(embedding_handler.get_vocabulary_length()).get_margin_loss_v2(
+            true_embeddings, decoded_embeddings, random_words_embeddings, padding_mask, 1.0)
+        # the gradient is computed in every train step as well
+        gradient = tf.gradients(loss, decoded_embeddings)
+        with tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)) as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run([loss, gradient])
+            return measure(lambda: sess.run([loss, gradient]), parameters['batch_size'], parameters['repeats'])
+
+
+BENCHMARKS = [
+    ('batch_iterator_normalized_sentence', benchmark_normalized_sentence),
+    ('multi_batch_iterator_epoch', benchmark_multi_batch_iterator_epoch),
+    ('embedding_handler_get_word_to_index', benchmark_word_to_index),
+    ('embedding_handler_get_index_to_word', benchmark_index_to_word),
+    ('pre_trained_embedding_handler_load_from_files', benchmark_load_from_files),
+    ('model_trainer_translate_embeddings', benchmark_translate_embeddings),
+    ('loss_handler_get_margin_loss_v2', benchmark_margin_loss),
+]
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(parameters):
+    random_state = np.random.RandomState(parameters['seed'])
+    embedding_handler = create_synthetic_embedding_handler(parameters['vocabulary_size'],
+                                                           parameters['embedding_size'])
+    sentences = create_sentences(embedding_handler, parameters, random_state)
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        results[name] = benchmark(embedding_handler, sentences, parameters)
+        print('{:50s} {:14.1f} items/sec (min {:.4f} seconds)'.format(name, results[name]['items_per_second'],
+                                                                     results[name]['min_seconds']))
+    return {
+        'commit': get_commit(),
+        'machine': platform.platform(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__,
+        'parameters': parameters,
+        'benchmarks': results,
+    }
+
+
+def compare(base_file, new_file):
+    with open(base_file) as f:
+        base = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    if base['parameters'] != new['parameters']:
+        print('warning: the benchmarks ran with different parameters')
+    print('{:50s} {:>14s} {:>14s} {:>8s}'.format('benchmark', 'base items/sec', 'new items/sec', 'speedup'))
+    for name in sorted(set(base['benchmarks']) & set(new['benchmarks'])):
+        base_speed = base['benchmarks'][name]['items_per_second']
+        new_speed = new['benchmarks'][name]['items_per_second']
+        print('{:50s} {:14.1f} {:14.1f} {:7.2f}x'.format(name, base_speed, new_speed, new_speed / base_speed))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        results = run_benchmarks(PARAMETERS)
+        if len(sys.argv) > 1:
+            output_file = sys.argv[1]
+        else:
+            output_file = os.path.join('benchmarks', '{}.json'.format((results['commit'] or 'results')[:10]))
+        if os.path.dirname(output_file) and not os.path.exists(os.path.dirname(output_file)):
+            os.makedirs(os.path.dirname(output_file))
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('results saved to {}'.format(output_file))
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tensorflow as tf
+import yaml
+
+from datasets.yelp_helpers import YelpSentences
+from v1_embedding.exported_embedding_handler import ExportedEmbeddingHandler
+from v1_embedding.inference_model import InferenceModel
+from v1_embedding.pre_trained_embedding_handler import PreTrainedEmbeddingHandler
+
+
+def get_work_dir(config):
+    # the work dir of ModelTrainer
+    return os.path.join(os.getcwd(), 'models', 'ModelTrainer_{}'.format(config['model']['discriminator_type']))
+
+
+def get_export_dir(config):
+    return os.path.join(get_work_dir(config), 'export')
+
+
+def get_embedding_handler(config, operational_config):
+    work_dir = get_work_dir(config)
+    dataset_cache_dir = os.path.join(work_dir, 'dataset_cache')
+    # the datasets are only read if the embedding was not cached by the trainer
+    datasets = [
+        YelpSentences(positive=not operational_config['positive_is_positive'],
+                      limit_sentences=config['sentence']['limit'],
+                      dataset_cache_dir=dataset_cache_dir,
+                      dataset_name='neg'),
+        YelpSentences(positive=operational_config['positive_is_positive'],
+                      limit_sentences=config['sentence']['limit'],
+                      dataset_cache_dir=dataset_cache_dir,
+                      dataset_name='pos')
+    ]
+    return PreTrainedEmbeddingHandler(
+        os.path.join(work_dir, 'embedding'),
+        datasets,
+        config['embedding']['word_size'],
+        config['embedding']['min_word_occurrences']
+    )
+
+
+def export_model(config, embedding_handler, checkpoint_dir, export_dir, checkpoint_path=None):
+    if checkpoint_path is None:
+        checkpoint = tf.train.get_checkpoint_state(checkpoint_dir)
+        if checkpoint is None:
+            raise Exception('Model not found in: {}'.format(checkpoint_dir))
+        checkpoint_path = checkpoint.model_checkpoint_path
+
+    # restore the inference variables from the training checkpoint and turn them into constants
+    graph = tf.Graph()
+    with graph.as_default():
+        model = InferenceModel(config, embedding_handler)
+        saver = tf.train.Saver(var_list=tf.global_variables())
+        with tf.Session(graph=graph) as sess:
+            saver.restore(sess, checkpoint_path)
+            frozen_graph_def = tf.graph_util.convert_variables_to_constants(
+                sess, graph.as_graph_def(), [model.transferred_source_indices.op.name]
+            )
+    print('Model restored from file: {}\n'.format(checkpoint_path))
+
+    if os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
+    frozen_graph = tf.Graph()
+    with frozen_graph.as_default():
+        tf.import_graph_def(frozen_graph_def, name='')
+        signature = tf.saved_model.signature_def_utils.predict_signature_def(
+            inputs={
+                'source_batch': frozen_graph.get_tensor_by_name(model.source_batch.name),
+                'source_lengths': frozen_graph.get_tensor_by_name(model.source_lengths.name),
+            },
+            outputs={
+                'transferred': frozen_graph.get_tensor_by_name(model.transferred_source_indices.name),
+            }
+        )
+        with tf.Session(graph=frozen_graph) as sess:
+            builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
+            builder.add_meta_graph_and_variables(
+                sess, [tf.saved_model.tag_constants.SERVING],
+                signature_def_map={tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY: signature}
+            )
+            builder.save()
+
+    ExportedEmbeddingHandler.save_vocabulary(embedding_handler, export_dir)
+    with open(os.path.join(export_dir, 'inference.yml'), 'w') as f:
+        yaml.dump({
+            'sentence_length': config['sentence']['min_length'],
+            'checkpoint': checkpoint_path,
+        }, f, default_flow_style=False)
+    print('Model exported to: {}\n'.format(export_dir))
+
+
+if __name__ == "__main__":
+    with open("config/gan.yml", 'r') as ymlfile:
+        config = yaml.load(ymlfile)
+    with open("config/operational.yml", 'r') as ymlfile:
+        operational_config = yaml.load(ymlfile)
+    export_model(config,
+                 get_embedding_handler(config, operational_config),
+                 os.path.join(get_work_dir(config), 'saver'),
+                 get_export_dir(config))
@@ -1,5 +1,10 @@
 import datetime
 import os
+import random
+import socket
+import subprocess
+import sys
+import time
 import numpy as np
 import tensorflow as tf
 import yaml
@@ -7,15 +12,30 @@ import yaml
 from datasets.multi_batch_iterator import MultiBatchIterator
 from datasets.yelp_helpers import YelpSentences
 from v1_embedding.gan_model import GanModel
-from v1_embedding.logger import init_logger
+from v1_embedding.logger import init_logger, get_async_writer, MetricsStream
+from v1_embedding.memory_report import MemoryReport
 from v1_embedding.pre_trained_embedding_handler import PreTrainedEmbeddingHandler
+from v1_embedding.sampling_profiler import SamplingProfiler
 from v1_embedding.saver_wrapper import SaverWrapper
+from v1_embedding.step_metrics import StepMetrics
+from v1_embedding.step_tracer import StepTracer
+from v1_embedding.training_state import TrainingState
 
 
 class ModelTrainer:
-    def __init__(self, config_file, operational_config_file):
+    def __init__(self, config_file, operational_config_file, job_name=None, task_index=0):
         self.config = config_file
         self.operational_config = operational_config_file
+        self.memory_report = MemoryReport(self.operational_config['memory']['trace_python_heap'])
+        # distributed training: this process is one of the workers of the cluster
+        self.server = None
+        self.task_index = task_index
+        self.is_chief = task_index == 0
+        self.num_workers = 1
+        if job_name is not None:
+            cluster_spec = ModelTrainer.get_cluster_spec(self.operational_config)
+            self.server = tf.train.Server(cluster_spec, job_name=job_name, task_index=task_index)
+            self.num_workers = cluster_spec.num_tasks('worker')
 
         self.work_dir = os.path.join(os.getcwd(), 'models', self.get_trainer_name())
         self.dataset_cache_dir = os.path.join(self.work_dir, 'dataset_cache')
@@ -39,67 +59,426 @@ class ModelTrainer:
             self.config['embedding']['word_size'],
             self.config['embedding']['min_word_occurrences']
         )
+        self.memory_report.record_phase('embedding')
+
+        # the seed of the data order, a resumed run takes it from the checkpoint
+        self.seed = self.config['trainer']['seed']
+        if self.seed is None:
+            self.seed = random.randint(0, 2 ** 31 - 1)
+        else:
+            tf.set_random_seed(self.seed)
 
         contents = MultiBatchIterator.preprocess(datasets)
+        self.memory_report.record_phase('datasets')
         # iterators
         self.batch_iterator = MultiBatchIterator(contents,
                                                  self.embedding_handler,
                                                  self.config['sentence']['min_length'],
-                                                 self.config['trainer']['batch_size'])
+                                                 self.config['trainer']['batch_size'],
+                                                 seed=self.seed,
+                                                 shard_index=self.task_index,
+                                                 num_shards=self.num_workers,
+                                                 length_buckets=self.config['trainer']['length_buckets'],
+                                                 pad_ragged_batches=self.config['trainer']['pad_ragged_batches'])
 
-        # set the model
-        self.model = GanModel(self.config, self.operational_config, self.embedding_handler)
-        self.saver_wrapper = SaverWrapper(self.work_dir, self.get_trainer_name())
+        # set the model, in a distributed run the variables are placed on the parameter servers
+        with tf.device(self.get_device_setter()):
+            self.model = GanModel(self.config, self.operational_config, self.embedding_handler,
+                                  num_replicas=self.num_workers)
+            self.training_state = TrainingState(self.seed)
+            # not saved, set by the chief once the model is initialized or restored
+            self.chief_ready = tf.Variable(False, trainable=False, collections=[], name='chief_ready')
+            checkpoint_config = self.operational_config['checkpoint']
+            self.saver_wrapper = SaverWrapper(self.work_dir, self.get_trainer_name(),
+                                              max_to_keep=checkpoint_config['max_to_keep'],
+                                              keep_checkpoint_every_n_hours=checkpoint_config['keep_every_n_hours'],
+                                              asynchronous=checkpoint_config['asynchronous'],
+                                              session_config=ModelTrainer.get_local_session_config(
+                                                  self.get_session_config()))
+        self.memory_report.record_phase('graph_build')
+        self.last_checkpoint_time = time.time()
+        self.step_metrics = StepMetrics(self.embedding_handler.get_vocabulary_length(),
+                                        self.operational_config['step_metrics']['window'])
+        tracing_config = self.operational_config['tracing']
+        self.step_tracer = StepTracer(os.path.join(self.work_dir, 'traces'), tracing_config['start_step'],
+                                      tracing_config['end_step'], tracing_config['top_ops'])
+        self.profiler = SamplingProfiler.from_config(os.path.join(self.work_dir, 'profiles'), self.operational_config)
+        # generator outputs reused by consecutive discriminator steps
+        self.cached_generator_outputs = None
+        # the batches of the epoch that only fed steps on cached generator outputs, so their sentences were not used
+        self.unused_batches = 0
+        # the memory of the last traced train step, written with the next report
+        self.step_memory = None
+        # the losses of the last train step, written to the metrics stream
+        self.step_losses = None
+        self.metrics_stream = None
+        # (update step, trains the generator) of the current update, all its micro batches train the same model
+        self.update_phase = None
 
     def get_trainer_name(self):
         return '{}_{}'.format(self.__class__.__name__, self.config['model']['discriminator_type'])
 
-    def do_train_loop(self, name):
+    @staticmethod
+    def get_cluster_spec(operational_config):
+        return tf.train.ClusterSpec(operational_config['cluster'])
+
+    def get_device_setter(self):
+        if self.server is None:
+            return None
+        return tf.train.replica_device_setter(worker_device='/job:worker/task:{}'.format(self.task_index),
+                                              cluster=ModelTrainer.get_cluster_spec(self.operational_config))
+
+    def get_session_config(self):
         session_config = tf.ConfigProto(log_device_placement=self.operational_config['print_device'],
                                         allow_soft_placement=True)
         session_config.gpu_options.allow_growth = True
+        ModelTrainer.set_threads_session_config(self.operational_config, session_config)
+        ModelTrainer.set_towers_session_config(self.config, session_config)
         if self.operational_config['run_optimizer']:
             session_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
-        with tf.Session(config=session_config) as sess:
-            use_tensorboard = self.operational_config['tensorboard_frequency'] > 0
-            summary_writer_train = tf.summary.FileWriter(os.path.join(self.summaries_dir, 'train'),
-                                                         sess.graph) if use_tensorboard else None
-            summary_writer_validation = tf.summary.FileWriter(
-                os.path.join(self.summaries_dir, 'validation')) if use_tensorboard else None
-
-            sess.run(tf.global_variables_initializer())
-            if self.operational_config['load_model']:
-                self.saver_wrapper.load_model(sess)
-
-            self.do_before_train_loop(sess)
-            global_step = 0
-            for epoch_num in range(self.config['trainer']['number_of_epochs']):
-                print('epoch {} of {}'.format(epoch_num + 1, self.config['trainer']['number_of_epochs']))
-                self.do_before_epoch(sess, global_step, epoch_num)
-                for batch_index, batch in enumerate(self.batch_iterator):
-                    if (global_step % self.operational_config['validation_batch_frequency']) == 1:
-                        validation_summaries = self.do_validation_batch(
-                            sess, global_step, epoch_num, batch, use_tensorboard, name
-                        )
-                        if validation_summaries:
-                            summary_writer_validation.add_summary(validation_summaries, global_step=global_step)
-                    extract_summaries = use_tensorboard and \
-                                        (global_step % self.operational_config['tensorboard_frequency'] == 1)
-                    train_summaries = self.do_train_batch(sess, global_step, epoch_num, batch_index, batch,
-                                                          extract_summaries=extract_summaries)
-                    if train_summaries:
-                        summary_writer_train.add_summary(train_summaries, global_step=global_step)
-                    global_step += 1
-                self.do_after_epoch(sess, global_step, epoch_num)
-            self.do_after_train_loop(sess)
+        if self.server is not None:
+            # only talk to the parameter servers and not to the other workers
+            session_config.device_filters.extend(['/job:ps', '/job:worker/task:{}'.format(self.task_index)])
+        return session_config
+
+    @staticmethod
+    def get_local_session_config(session_config):
+        # the thread settings of the training session for the sessions of local graphs (the device filters of a
+        # distributed run would hide the local devices)
+        local_session_config = tf.ConfigProto()
+        local_session_config.CopyFrom(session_config)
+        del local_session_config.device_filters[:]
+        return local_session_config
+
+    @staticmethod
+    def get_process_thread_count():
+        try:
+            return len(os.listdir('/proc/self/task'))
+        except OSError:
+            return None
+
+    @staticmethod
+    def check_thread_settings(session_config, threads_before_session):
+        # tensorflow creates the inter op and intra op thread pools with the first session of the process, and later
+        # sessions share them. if the pools existed before the training session, its thread settings are ignored
+        threads_after_session = ModelTrainer.get_process_thread_count()
+        if threads_before_session is None or threads_after_session is None:
+            return
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        intra_op_threads = session_config.intra_op_parallelism_threads or cores
+        inter_op_threads = session_config.inter_op_parallelism_threads or cores
+        new_threads = threads_after_session - threads_before_session
+        if new_threads < intra_op_threads + inter_op_threads:
+            print('warning: the training session started {} threads instead of {} intra op and {} inter op threads, '
+                  'the thread pools were created by an earlier session and the thread settings are not in '
+                  'effect'.format(new_threads, intra_op_threads, inter_op_threads))
+        else:
+            print('thread settings in effect: {} intra op threads, {} inter op threads'.format(intra_op_threads,
+                                                                                            inter_op_threads))
+
+    def do_train_loop(self, name):
+        session_config = self.get_session_config()
+        target = ''
+        if self.server is not None:
+            target = self.server.target
+        # validation in a separate process that evaluates the checkpoints
+        use_sidecar = self.operational_config['validation']['sidecar']
+        sidecar_process = None
+        if self.is_chief and use_sidecar and self.operational_config['validation']['start_sidecar']:
+            # the sidecar exits by itself if this process dies without stopping it
+            sidecar_process = subprocess.Popen([sys.executable, '-m', 'v1_embedding.validation_sidecar', name,
+                                                str(os.getpid())])
+        try:
+            threads_before_session = ModelTrainer.get_process_thread_count()
+            with tf.Session(target, config=session_config) as sess:
+                if self.server is None:
+                    ModelTrainer.check_thread_settings(session_config, threads_before_session)
+                # only the chief writes summaries, validates and saves
+                use_tensorboard = self.is_chief and self.operational_config['tensorboard_frequency'] > 0
+                summary_writer_train = tf.summary.FileWriter(os.path.join(self.summaries_dir, 'train'),
+                                                             sess.graph) if use_tensorboard else None
+                summary_writer_validation = tf.summary.FileWriter(
+                    os.path.join(self.summaries_dir, 'validation')) if use_tensorboard and not use_sidecar else None
+
+                if self.is_chief:
+                    sess.run(self.chief_ready.initializer)
+                    sess.run(tf.global_variables_initializer())
+                    if self.operational_config['load_model']:
+                        self.saver_wrapper.load_model(sess)
+                    self.do_before_train_loop(sess)
+                    if self.config['trainer']['length_buckets'] is not None and self.server is None:
+                        self.do_warm_up(sess)
+                    sess.run(tf.assign(self.chief_ready, True))
+                else:
+                    self.wait_for_chief(sess)
+                coordinator = self.start_sync_replicas(sess)
+                self.memory_report.record_phase('session_init')
+                self.metrics_stream = MetricsStream(os.path.join('logs', '{}_metrics.jsonl'.format(name)))
+                # continue from the position saved in the checkpoint (or from the start)
+                training_state = self.training_state.get(sess)
+                global_step = training_state['global_step']
+                start_epoch = training_state['epoch']
+                start_batch_index = training_state['batch_index']
+                self.seed = training_state['seed']
+                self.restore_update_phase(training_state)
+                self.batch_iterator.seed = self.seed
+                self.report_startup_memory(global_step, summary_writer_train)
+                if global_step > 0:
+                    print('resuming from global step {} epoch {} batch {}'.format(global_step, start_epoch + 1,
+                                                                                 start_batch_index))
+                for epoch_num in range(start_epoch, self.config['trainer']['number_of_epochs']):
+                    print('epoch {} of {}'.format(epoch_num + 1, self.config['trainer']['number_of_epochs']))
+                    skip_batches = start_batch_index if epoch_num == start_epoch else 0
+                    if skip_batches == 0:
+                        # a resumed epoch was already counted
+                        self.do_before_epoch(sess, global_step, epoch_num)
+                    epoch_batches = self.step_metrics.time_iterator(
+                        self.batch_iterator.get_epoch(epoch_num, skip_batches))
+                    for batch_index, batch in enumerate(epoch_batches, start=skip_batches):
+                        if self.is_chief and not use_sidecar and \
+                                (global_step % self.operational_config['validation_batch_frequency']) == 1:
+                            start_time = time.time()
+                            validation_summaries = self.do_validation_batch(
+                                sess, global_step, epoch_num, batch, use_tensorboard, name
+                            )
+                            self.step_metrics.add_time('validation', time.time() - start_time)
+                            if validation_summaries:
+                                start_time = time.time()
+                                summary_writer_validation.add_summary(validation_summaries, global_step=global_step)
+                                self.step_metrics.add_time('summary_write', time.time() - start_time)
+                        extract_summaries = use_tensorboard and \
+                                            (global_step % self.operational_config['tensorboard_frequency'] == 1)
+                        start_time = time.time()
+                        train_summaries = self.do_train_batch(sess, global_step, epoch_num, batch_index, batch,
+                                                              extract_summaries=extract_summaries)
+                        self.step_metrics.add_time('train_run', time.time() - start_time)
+                        if train_summaries:
+                            start_time = time.time()
+                            summary_writer_train.add_summary(train_summaries, global_step=global_step)
+                            self.step_metrics.add_time('summary_write', time.time() - start_time)
+                        global_step += 1
+                        start_time = time.time()
+                        self.do_checkpoint_if_needed(sess, global_step, epoch_num, batch_index + 1)
+                        self.step_metrics.add_time('checkpoint', time.time() - start_time)
+                        self.step_metrics.end_step(batch)
+                        self.step_tracer.write_summary_if_done(global_step)
+                        self.profiler.update(global_step)
+                        self.report_step_metrics(global_step, summary_writer_train)
+                        self.report_step_memory(global_step, summary_writer_train)
+                        self.report_metrics_stream(global_step, epoch_num)
+                    start_time = time.time()
+                    self.do_after_epoch(sess, global_step, epoch_num)
+                    self.step_metrics.add_epoch_end_time(time.time() - start_time)
+                self.profiler.stop()
+                if coordinator is not None:
+                    coordinator.request_stop()
+                if not self.is_chief:
+                    return
+                self.saver_wrapper.wait_for_save()
+                ModelTrainer.stop_sidecar(sidecar_process)
+                self.do_after_train_loop(sess)
+        finally:
+            # also when the training fails, so the sidecar is never left without its trainer
+            ModelTrainer.stop_sidecar(sidecar_process)
+
+    @staticmethod
+    def stop_sidecar(sidecar_process):
+        if sidecar_process is None or sidecar_process.poll() is not None:
+            return
+        sidecar_process.terminate()
+        # the sidecar writes its queued logs before it exits
+        sidecar_process.wait()
+
+    def report_startup_memory(self, global_step, summary_writer):
+        structure_sizes = MemoryReport.get_structure_sizes({'neg': self.dataset_neg, 'pos': self.dataset_pos},
+                                                           self.embedding_handler)
+        print('size of cached structures (MB): {}'.format(MemoryReport.format_values(structure_sizes)))
+        values = dict(structure_sizes)
+        for phase, phase_values in self.memory_report.phases.items():
+            values.update({'{}_{}'.format(phase, k): v for k, v in phase_values.items()})
+        if summary_writer is not None:
+            summary_writer.add_summary(MemoryReport.get_summary(values), global_step=global_step)
+
+    def should_report_memory(self, global_step):
+        frequency = self.operational_config['memory']['frequency']
+        return frequency > 0 and global_step % frequency == 0
+
+    def report_step_memory(self, global_step, summary_writer):
+        if self.step_memory is None:
+            return
+        values = dict(self.step_memory)
+        values.update(self.memory_report.get_process_memory())
+        self.step_memory = None
+        print('memory at step {}: {}'.format(global_step, MemoryReport.format_values(values)))
+        if summary_writer is not None:
+            summary_writer.add_summary(MemoryReport.get_summary(values), global_step=global_step)
+
+    def should_stream_metrics(self, global_step):
+        frequency = self.operational_config['metrics_stream']['frequency']
+        return frequency > 0 and global_step % frequency == 0
+
+    def get_loss_fetches(self, epoch, global_step):
+        return self.get_model_loss_fetches(self.should_train_generator(epoch, global_step))
+
+    def get_model_loss_fetches(self, train_generator):
+        if train_generator:
+            return {
+                'generator_loss': self.model.generator_loss,
+                'reconstruction_loss': self.model.reconstruction_loss,
+                'discriminator_loss': self.model.discriminator_loss,
+                'accuracy': self.model.accuracy,
+            }
+        if self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+            return {
+                'discriminator_loss': self.model.cached_discriminator_loss,
+                'accuracy': self.model.cached_accuracy,
+            }
+        return {
+            'discriminator_loss': self.model.discriminator_loss,
+            'accuracy': self.model.accuracy,
+        }
+
+    def report_metrics_stream(self, global_step, epoch_num):
+        if self.step_losses is None:
+            return
+        values = {k: float(v) for k, v in self.step_losses.items()}
+        values.update(self.step_metrics.get_metrics())
+        values.update({
+            'step': global_step,
+            'epoch': epoch_num,
+            'train_generator': self.should_train_generator(epoch_num, global_step - 1),
+        })
+        self.step_losses = None
+        self.metrics_stream.write(values)
+
+    def report_step_metrics(self, global_step, summary_writer):
+        if global_step % self.operational_config['step_metrics']['log_frequency'] != 0:
+            return
+        print(self.step_metrics.get_log_line(global_step))
+        if summary_writer is not None:
+            summary_writer.add_summary(self.step_metrics.get_summary(), global_step=global_step)
+
+    def wait_for_chief(self, sess):
+        chief_ready_initialized = tf.is_variable_initialized(self.chief_ready)
+        while not (sess.run(chief_ready_initialized) and sess.run(self.chief_ready)):
+            print('waiting for the chief to initialize the model')
+            time.sleep(1)
+
+    def start_sync_replicas(self, sess):
+        if not self.model.sync_optimizers:
+            return None
+        sess.run(tf.local_variables_initializer())
+        sess.run([optimizer.local_step_init_op for optimizer in self.model.sync_optimizers])
+        if not self.is_chief:
+            return None
+        # the chief aggregates the gradients of all the workers and hands out the tokens for the next step
+        coordinator = tf.train.Coordinator()
+        for optimizer in self.model.sync_optimizers:
+            optimizer.get_chief_queue_runner().create_threads(sess, coord=coordinator, daemon=True, start=True)
+            sess.run(optimizer.get_init_tokens_op())
+        return coordinator
+
+    @staticmethod
+    def run_parameter_server(operational_config, task_index):
+        server = tf.train.Server(ModelTrainer.get_cluster_spec(operational_config), job_name='ps',
+                                 task_index=task_index)
+        server.join()
+
+    @staticmethod
+    def get_tuned_threads_file(operational_config):
+        return os.path.join(operational_config['threads']['tuned_dir'], '{}.yml'.format(socket.gethostname()))
+
+    @staticmethod
+    def set_threads_session_config(operational_config, session_config):
+        threads_config = operational_config['threads']
+        tuned_threads_file = ModelTrainer.get_tuned_threads_file(operational_config)
+        if threads_config['use_tuned'] and os.path.exists(tuned_threads_file):
+            with open(tuned_threads_file, 'r') as ymlfile:
+                threads_config = yaml.load(ymlfile)
+            print('using the thread settings in {}'.format(tuned_threads_file))
+        session_config.intra_op_parallelism_threads = threads_config['intra_op_threads']
+        session_config.inter_op_parallelism_threads = threads_config['inter_op_threads']
+
+    @staticmethod
+    def set_towers_session_config(config, session_config):
+        # every tower runs on its own cpu device
+        towers = config['trainer']['towers']
+        session_config.device_count['CPU'] = towers
+        tower_threads = config['trainer']['tower_threads']
+        if towers > 1 and tower_threads > 0:
+            # give every cpu device its own intra op thread pool instead of the global one
+            os.environ['TF_OVERRIDE_GLOBAL_THREADPOOL'] = '1'
+            session_config.intra_op_parallelism_threads = tower_threads
 
     def do_before_train_loop(self, sess):
         sess.run(self.model.embedding_container.assign_embedding(), {
             self.model.embedding_container.embedding_placeholder: self.embedding_handler.embedding_np
         })
 
-    def do_train_batch(self, sess, global_step, epoch_num, batch_index, batch, extract_summaries):
-        feed_dict = {
+    def do_warm_up(self, sess):
+        # run every step once on every shape of batch, so the graph of every shape is compiled before the training
+        # starts. the variables are restored afterwards so the warm up does not change the model
+        warm_up_saver = tf.train.Saver(max_to_keep=1)
+        warm_up_path = warm_up_saver.save(sess, os.path.join(self.work_dir, 'warm_up', 'warm_up'),
+                                          write_meta_graph=False)
+        steps = self.get_warm_up_steps()
+        total_compile_time = 0.0
+        for batch in self.batch_iterator.get_warm_up_batches():
+            train_feed_dict = self.get_train_feed_dict(batch)
+            cached_feed_dict = None
+            if self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+                generator_outputs = sess.run(self.model.generator_outputs, train_feed_dict)
+                cached_feed_dict = dict(zip(self.model.cached_generator_outputs_placeholders, generator_outputs))
+                cached_feed_dict[self.model.discriminator_dropout_placeholder] = \
+                    self.config['model']['discriminator_dropout']
+            for step_name, step, cached in steps:
+                feed_dict = cached_feed_dict if cached else train_feed_dict
+                start_time = time.time()
+                sess.run(step, feed_dict)
+                first_run_time = time.time() - start_time
+                # the second run is already compiled
+                start_time = time.time()
+                sess.run(step, feed_dict)
+                step_time = time.time() - start_time
+                compile_time = max(first_run_time - step_time, 0.0)
+                total_compile_time += compile_time
+                print('warm up length {} {}: compile {:.2f} seconds, step {:.3f} seconds'.format(
+                    len(batch[0].sentences[0]), step_name, compile_time, step_time))
+        warm_up_saver.restore(sess, warm_up_path)
+        print('warm up compile time {:.2f} seconds'.format(total_compile_time))
+
+    def get_warm_up_steps(self):
+        # every set of fetches of the train loop is a separate graph to compile: the train steps (or the accumulate
+        # steps), with the summaries and with the losses of the metrics stream. returns (name, fetches, cached feed)
+        steps = []
+        use_tensorboard = self.is_chief and self.operational_config['tensorboard_frequency'] > 0
+        stream_metrics = self.operational_config['metrics_stream']['frequency'] > 0
+        reuse_generator_outputs = self.config['trainer']['reuse_generator_outputs_for_discriminator']
+        for train_generator in [True, False]:
+            model_name = 'generator' if train_generator else 'discriminator'
+            cached = not train_generator and reuse_generator_outputs
+            train_step, summary_step = self.get_model_train_step_and_summary(train_generator)
+            model_steps = [(model_name, train_step)]
+            accumulate_step = self.model.generator_accumulate_step if train_generator else \
+                self.model.discriminator_accumulate_step
+            if accumulate_step is not None:
+                model_steps.append(('{} accumulate'.format(model_name), accumulate_step))
+            for step_name, step in model_steps:
+                variants = [('', {})]
+                if use_tensorboard and summary_step is not None:
+                    variants.append((' summaries', {'summary': summary_step}))
+                if stream_metrics:
+                    variants.append((' losses', {'losses': self.get_model_loss_fetches(train_generator)}))
+                if len(variants) == 3:
+                    variants.append((' summaries losses', dict(variants[1][1], **variants[2][1])))
+                for variant_name, extra_fetches in variants:
+                    steps.append(('{}{}'.format(step_name, variant_name), dict(extra_fetches, train_step=step), cached))
+        steps.append(('transfer', [self.model.transferred_source_batch, self.model.reconstructed_targets_batch],
+                      False))
+        return steps
+
+    def get_train_feed_dict(self, batch):
+        return {
             self.model.source_batch: batch[0].sentences,
             self.model.target_batch: batch[1].sentences,
             self.model.source_lengths: batch[0].lengths,
@@ -107,14 +486,75 @@ class ModelTrainer:
             self.model.dropout_placeholder: self.config['model']['dropout'],
             self.model.discriminator_dropout_placeholder: self.config['model']['discriminator_dropout'],
         }
+
+    def do_train_batch(self, sess, global_step, epoch_num, batch_index, batch, extract_summaries):
+        feed_dict = self.get_train_feed_dict(batch)
+        if self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+            if self.should_train_generator(epoch_num, global_step):
+                # the generator weights are about to change
+                self.cached_generator_outputs = None
+            else:
+                if self.cached_generator_outputs is not None:
+                    # the step trains on the outputs of an earlier batch
+                    self.unused_batches += 1
+                feed_dict = self.get_cached_generator_outputs_feed_dict(sess, feed_dict)
         train_step, summary_step = self.get_train_step_and_summary(epoch_num, global_step)
+        step_name = 'generator' if self.should_train_generator(epoch_num, global_step) else 'discriminator'
+        accumulation_steps = self.config['trainer']['accumulation_steps']
+        if accumulation_steps > 1 and (global_step + 1) % accumulation_steps != 0:
+            # not the last micro batch of the update, only accumulate its gradients
+            train_step = self.get_accumulate_step(epoch_num, global_step)
+            step_name += '_accumulate'
+        run_options, run_metadata = None, None
+        trace_step = self.step_tracer.should_trace(global_step)
+        report_memory = self.should_report_memory(global_step)
+        if trace_step or report_memory:
+            # the memory of the step is in the step stats of a full trace
+            run_options, run_metadata = StepTracer.get_run_options(), tf.RunMetadata()
+        fetches = {'train_step': train_step}
         if extract_summaries:
-            _, summary = sess.run([train_step, summary_step], feed_dict)
-        else:
-            summary = None
-            _ = sess.run(train_step, feed_dict)
+            fetches['summary'] = summary_step
+        if self.should_stream_metrics(global_step):
+            fetches['losses'] = self.get_loss_fetches(epoch_num, global_step)
+        results = sess.run(fetches, feed_dict, options=run_options, run_metadata=run_metadata)
+        summary = results.get('summary')
+        self.step_losses = results.get('losses')
+        if trace_step:
+            self.step_tracer.add_trace(global_step, step_name, run_metadata)
+            if global_step == self.step_tracer.start_step:
+                self.trace_gradients_step(sess, global_step, epoch_num, batch)
+        if report_memory:
+            self.step_memory = self.memory_report.report_step(step_name, run_metadata)
         return summary
 
+    def trace_gradients_step(self, sess, global_step, epoch_num, batch):
+        # the model that is not trained in this step may not be trained at all in the window (during the initial
+        # generator epochs), so its gradients are traced on the same batch without applying them. the gradient steps do
+        # not change any variable or state of the trainer
+        feed_dict = self.get_train_feed_dict(batch)
+        if not self.should_train_generator(epoch_num, global_step):
+            gradients_step, step_name = self.model.generator_gradients_step, 'generator_gradients'
+        elif self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+            # not kept in the cache of the discriminator steps
+            generator_outputs = sess.run(self.model.generator_outputs, feed_dict)
+            feed_dict = dict(zip(self.model.cached_generator_outputs_placeholders, generator_outputs))
+            feed_dict[self.model.discriminator_dropout_placeholder] = self.config['model']['discriminator_dropout']
+            gradients_step, step_name = self.model.cached_discriminator_gradients_step, 'discriminator_gradients'
+        else:
+            gradients_step, step_name = self.model.discriminator_gradients_step, 'discriminator_gradients'
+        run_metadata = tf.RunMetadata()
+        sess.run(gradients_step, feed_dict, options=StepTracer.get_run_options(), run_metadata=run_metadata)
+        self.step_tracer.add_trace(global_step, step_name, run_metadata)
+
+    def get_cached_generator_outputs_feed_dict(self, sess, feed_dict):
+        if self.cached_generator_outputs is None:
+            # first discriminator step since the generator was trained
+            self.cached_generator_outputs = sess.run(self.model.generator_outputs, feed_dict)
+        cached_feed_dict = dict(zip(self.model.cached_generator_outputs_placeholders, self.cached_generator_outputs))
+        cached_feed_dict[self.model.discriminator_dropout_placeholder] = \
+            self.config['model']['discriminator_dropout']
+        return cached_feed_dict
+
     def do_validation_batch(self, sess, global_step, epoch_num, batch, extract_summary, name):
         target, reconstructed, source, transferred = self.transfer_batch(sess, batch)
         self.print_to_file(global_step, epoch_num, source, os.path.join('logs', '{}_source.log'.format(name)))
@@ -146,12 +586,40 @@ class ModelTrainer:
             break
 
     def do_before_epoch(self, sess, global_step, epoch_num):
-        sess.run(self.model.epoch_counter.update)
+        if self.is_chief:
+            sess.run(self.model.epoch_counter.update)
 
     def do_after_epoch(self, sess, global_step, epoch_num):
-        if epoch_num % 10 == 0:
-            # activate the saver
-            self.saver_wrapper.save_model(sess, global_step=global_step)
+        if self.unused_batches > 0:
+            print('epoch {}: {} batches were not used, their discriminator steps trained on cached generator '
+                  'outputs'.format(epoch_num + 1, self.unused_batches))
+            self.unused_batches = 0
+        if not self.is_chief:
+            return
+        every_epochs = self.operational_config['checkpoint']['every_epochs']
+        if every_epochs > 0 and epoch_num % every_epochs == 0:
+            # the epoch is done, resume from the start of the next one
+            self.save_checkpoint(sess, global_step, epoch_num + 1, 0)
+
+    def do_checkpoint_if_needed(self, sess, global_step, epoch_num, next_batch_index):
+        if not self.is_chief:
+            return
+        checkpoint_config = self.operational_config['checkpoint']
+        every_steps = checkpoint_config['every_steps']
+        every_minutes = checkpoint_config['every_minutes']
+        if every_steps > 0 and global_step % every_steps == 0:
+            self.save_checkpoint(sess, global_step, epoch_num, next_batch_index)
+        elif every_minutes > 0 and time.time() - self.last_checkpoint_time >= every_minutes * 60:
+            self.save_checkpoint(sess, global_step, epoch_num, next_batch_index)
+
+    def save_checkpoint(self, sess, global_step, epoch_num, next_batch_index):
+        # store the position of the training loop with the model
+        update_step, update_generator = self.update_phase if self.update_phase is not None else (-1, -1)
+        self.training_state.set(sess, global_step, epoch_num, next_batch_index, self.seed, update_step,
+                                int(update_generator), global_step % self.config['trainer']['accumulation_steps'])
+        # activate the saver
+        self.saver_wrapper.save_model(sess, global_step=global_step)
+        self.last_checkpoint_time = time.time()
 
     def transfer_batch(self, sess, batch):
         feed_dict = {
@@ -211,24 +679,57 @@ class ModelTrainer:
         return best_match
 
     def get_train_step_and_summary(self, epoch, global_step):
-        if self.should_train_generator(epoch, global_step):
+        return self.get_model_train_step_and_summary(self.should_train_generator(epoch, global_step))
+
+    def get_model_train_step_and_summary(self, train_generator):
+        if train_generator:
             return self.model.generator_train_step, self.model.generator_step_summaries
+        if self.config['trainer']['reuse_generator_outputs_for_discriminator']:
+            return self.model.cached_discriminator_train_step, self.model.cached_discriminator_step_summaries
         return self.model.discriminator_train_step, self.model.discriminator_step_summaries
 
+    def get_accumulate_step(self, epoch, global_step):
+        if self.should_train_generator(epoch, global_step):
+            return self.model.generator_accumulate_step
+        return self.model.discriminator_accumulate_step
+
     def should_train_generator(self, epoch, global_step):
+        # with gradient accumulation the model is chosen on the first micro batch of an update and kept for the rest of
+        # it, even when the update crosses the end of the initial generator epochs
+        update_step = global_step // self.config['trainer']['accumulation_steps']
+        if self.update_phase is None or self.update_phase[0] != update_step:
+            self.update_phase = (update_step, self.is_generator_update(epoch, update_step))
+        return self.update_phase[1]
+
+    def restore_update_phase(self, training_state):
+        # a run saved in the middle of an update continues it with the same model, so the accumulated gradients are
+        # applied to the model they were computed for
+        if training_state['micro_batch'] == 0 or training_state['update_generator'] < 0:
+            return
+        accumulation_steps = self.config['trainer']['accumulation_steps']
+        if training_state['micro_batch'] != training_state['global_step'] % accumulation_steps:
+            print('warning: the checkpoint was saved after micro batch {} of an update with a different '
+                  'accumulation_steps, the accumulated gradients are applied with the current '
+                  'setting'.format(training_state['micro_batch']))
+        self.update_phase = (training_state['global_step'] // accumulation_steps,
+                             training_state['update_generator'] == 1)
+        print('resuming an update of the {} after {} micro batches'.format(
+            'generator' if self.update_phase[1] else 'discriminator', training_state['micro_batch']))
+
+    def is_generator_update(self, epoch, update_step):
         if epoch < self.config['trainer']['initial_generator_epochs']:
             return True
         generator_steps = self.config['trainer']['min_generator_steps']
         discriminator_steps = self.config['trainer']['min_discriminator_steps']
-        return global_step % (generator_steps + discriminator_steps) < generator_steps
+        return update_step % (generator_steps + discriminator_steps) < generator_steps
 
     @staticmethod
     def print_to_file(global_step, epoch_number, sentences, file_name):
-        with open(file_name, 'a+') as f:
-            f.write('global step: {} epoch: {}\n'.format(global_step, epoch_number))
-            for i in range(len(sentences)):
-                f.write('{}\n'.format(sentences[i]))
-            f.write('-------------------------------------------------------------\n')
+        # written in the background
+        text = 'global step: {} epoch: {}\n'.format(global_step, epoch_number)
+        text += ''.join(['{}\n'.format(s) for s in sentences])
+        text += '-------------------------------------------------------------\n'
+        get_async_writer().write(file_name, text)
 
     @staticmethod
     def remove_by_length(sentences, lengths):
@@ -242,9 +743,16 @@ if __name__ == "__main__":
         config = yaml.load(ymlfile)
     with open("config/operational.yml", 'r') as ymlfile:
         operational_config = yaml.load(ymlfile)
+    # distributed training: python -m v1_embedding.model_trainer <ps|worker> <task index>
+    job_name = sys.argv[1] if len(sys.argv) > 1 else None
+    task_index = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    if job_name == 'ps':
+        ModelTrainer.run_parameter_server(operational_config, task_index)
+    if job_name is not None:
+        name = '{}_{}_{}'.format(name, job_name, task_index)
     init_logger(name)
     print('------------ Config ------------')
     print(yaml.dump(config))
     print('------------ Operational Config ------------')
     print(yaml.dump(operational_config))
-    ModelTrainer(config, operational_config).do_train_loop(name)
+    ModelTrainer(config, operational_config, job_name, task_index).do_train_loop(name)
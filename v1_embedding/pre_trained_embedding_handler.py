@@ -1,7 +1,8 @@
 from v1_embedding.embedding_handler import EmbeddingHandler
 import numpy as np
+import sys
 from os import getcwd
-from os.path import join
+from os.path import exists, join, splitext
 
 
 class PreTrainedEmbeddingHandler(EmbeddingHandler):
@@ -37,8 +38,46 @@ class PreTrainedEmbeddingHandler(EmbeddingHandler):
             file.close()
             return vocab, embd
 
-        vocab, embd = load_glove(self.pretrained_embedding_file, word_dict)
-        embedding = np.asarray(embd, dtype=np.float32)
+        matrix_file, vocabulary_file = PreTrainedEmbeddingHandler.get_binary_file_names(self.pretrained_embedding_file)
+        if exists(matrix_file) and exists(vocabulary_file):
+            vocab, embedding = PreTrainedEmbeddingHandler.load_binary(matrix_file, vocabulary_file, word_dict)
+        else:
+            vocab, embd = load_glove(self.pretrained_embedding_file, word_dict)
+            embedding = np.asarray(embd, dtype=np.float32)
         if self.end_of_sentence_token not in vocab or self.unknown_token not in vocab:
             raise Exception("end or unknown token does not exist")
         return vocab, embedding
+
+    @staticmethod
+    def get_binary_file_names(text_file_name):
+        # the binary format of an embedding file: a float32 .npy matrix and a vocabulary file with a word per row
+        base_name = splitext(text_file_name)[0]
+        return base_name + '.npy', base_name + '.vocab.txt'
+
+    @staticmethod
+    def save_binary(text_file_name, vocab, embedding):
+        matrix_file, vocabulary_file = PreTrainedEmbeddingHandler.get_binary_file_names(text_file_name)
+        np.save(matrix_file, np.asarray(embedding, dtype=np.float32))
+        with open(vocabulary_file, 'w') as f:
+            f.write(''.join(['{}\n'.format(w) for w in vocab]))
+        return matrix_file, vocabulary_file
+
+    @staticmethod
+    def load_binary(matrix_file, vocabulary_file, word_dictionary):
+        # the matrix is memory mapped, only the rows of the words in the dictionary are read
+        with open(vocabulary_file) as f:
+            file_vocab = [line.rstrip('\n') for line in f]
+        indices = [i for i, w in enumerate(file_vocab) if w in word_dictionary]
+        matrix = np.load(matrix_file, mmap_mode='r')
+        print('Loaded {}!'.format(matrix_file))
+        return [file_vocab[i] for i in indices], np.asarray(matrix[indices], dtype=np.float32)
+
+
+if __name__ == "__main__":
+    # converts a text embedding file to the binary format: python -m v1_embedding.pre_trained_embedding_handler <file>
+    text_file_name = sys.argv[1]
+    with open(text_file_name) as f:
+        rows = [line.rstrip().split(' ') for line in f]
+    matrix_file, _ = PreTrainedEmbeddingHandler.save_binary(text_file_name, [row[0] for row in rows],
+                                                            np.array([row[1:] for row in rows], dtype=np.float32))
+    print('saved {}'.format(matrix_file))
@@ -0,0 +1,111 @@
+import collections
+import datetime
+import os
+import signal
+import sys
+import threading
+
+
+class SamplingProfiler:
+    # samples the python stack of one thread every interval from a background thread, the samples are written as folded
+    # stacks (one 'outer;...;inner count' line per stack) that flamegraph.pl and speedscope read directly
+    def __init__(self, output_dir, interval_seconds=0.005, start_step=None, end_step=None):
+        self.output_dir = output_dir
+        self.interval_seconds = interval_seconds
+        self.start_step = start_step
+        self.end_step = end_step
+        # the thread that creates the profiler is sampled
+        self.thread_id = threading.current_thread().ident
+        self.samples = collections.Counter()
+        self.sampler_thread = None
+        self.stop_event = threading.Event()
+        self.output_name = None
+
+    def is_running(self):
+        return self.sampler_thread is not None
+
+    def start(self, output_name=None):
+        if self.is_running():
+            return
+        if output_name is None:
+            output_name = 'profile_{}'.format(datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+        self.output_name = output_name
+        self.samples = collections.Counter()
+        self.stop_event.clear()
+        self.sampler_thread = threading.Thread(target=self._sample_loop, name='sampling_profiler')
+        self.sampler_thread.daemon = True
+        self.sampler_thread.start()
+        print('sampling profiler started')
+
+    def stop(self):
+        if not self.is_running():
+            return None
+        self.stop_event.set()
+        self.sampler_thread.join()
+        self.sampler_thread = None
+        return self.write_samples()
+
+    def toggle(self):
+        if self.is_running():
+            self.stop()
+        else:
+            self.start()
+
+    def update(self, step):
+        # samples the steps in [start_step, end_step)
+        if self.start_step is None or self.end_step is None:
+            return
+        if step == self.start_step:
+            self.start('steps_{}_{}'.format(self.start_step, self.end_step))
+        elif step == self.end_step:
+            self.stop()
+
+    def install_signal_toggle(self, signal_number=None):
+        # start and stop a running process with: kill -USR1 <pid>
+        if signal_number is None:
+            if not hasattr(signal, 'SIGUSR1'):
+                return
+            signal_number = signal.SIGUSR1
+        signal.signal(signal_number, lambda signum, frame: self.toggle())
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[';'.join(stack)] += 1
+
+    def write_samples(self):
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        folded_file = os.path.join(self.output_dir, '{}.folded'.format(self.output_name))
+        with open(folded_file, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        # the functions that were running when sampled (self time), to spot the hot paths without a flame graph
+        total = sum(self.samples.values())
+        self_samples = collections.Counter()
+        for stack, count in self.samples.items():
+            self_samples[stack.split(';')[-1]] += count
+        top_file = os.path.join(self.output_dir, '{}_top.txt'.format(self.output_name))
+        with open(top_file, 'w') as f:
+            f.write('{} samples every {:.1f} ms\n'.format(total, self.interval_seconds * 1000.0))
+            for function, count in self_samples.most_common(50):
+                f.write('{:8.2%} {:8d} {}\n'.format(float(count) / total, count, function))
+        print('sampling profiler wrote {} samples to {}'.format(total, folded_file))
+        return folded_file
+
+    @staticmethod
+    def from_config(output_dir, operational_config):
+        profiler_config = operational_config['profiler']
+        profiler = SamplingProfiler(output_dir, profiler_config['interval_ms'] / 1000.0,
+                                    profiler_config['start_step'], profiler_config['end_step'])
+        if profiler_config['signal_toggle']:
+            profiler.install_signal_toggle()
+        return profiler
@@ -1,35 +1,113 @@
 import tensorflow as tf
 import os
 import datetime
+import threading
 import time
 
 
 class SaverWrapper:
-    def __init__(self, saver_dir, model_name):
+    def __init__(self, saver_dir, model_name, max_to_keep=3, keep_checkpoint_every_n_hours=10000.0,
+                 asynchronous=False, session_config=None):
         self.saver_dir = os.path.join(saver_dir, 'saver')
         now = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d_%H_%M_%S')
         self.saver_path = os.path.join(self.saver_dir, now)
-        self.saver = tf.train.Saver(max_to_keep=3, save_relative_paths=self.saver_dir)
+        # the variables of the saver, a checkpoint written before some of them were added is still restored
+        self.variables = tf.global_variables()
+        self.saver = tf.train.Saver(max_to_keep=max_to_keep,
+                                    keep_checkpoint_every_n_hours=keep_checkpoint_every_n_hours,
+                                    save_relative_paths=self.saver_dir)
+        self.asynchronous = asynchronous
+        # the config of the snapshot sessions, they are only created while saving (after the training session created
+        # the thread pools of the process)
+        self.session_config = session_config
+        self.save_thread = None
+        if asynchronous:
+            self._create_snapshot_saver(max_to_keep, keep_checkpoint_every_n_hours)
         if not os.path.exists(self.saver_dir):
             os.makedirs(self.saver_dir)
         print('models will be saved to: {}\n'.format(self.saver_dir))
 
+    def _create_snapshot_saver(self, max_to_keep, keep_checkpoint_every_n_hours):
+        # asynchronous saves copy the variable values from the training session, and a background thread writes the
+        # copy using a separate graph with the same variables. the session of that graph only lives while a save is
+        # written, so no copy of the variables is kept between saves
+        self.snapshot_variables = tf.global_variables()
+        self.snapshot_graph = tf.Graph()
+        with self.snapshot_graph.as_default():
+            self.snapshot_placeholders = []
+            snapshot_var_list = {}
+            initializers = []
+            for v in self.snapshot_variables:
+                placeholder = tf.placeholder(v.dtype.base_dtype, shape=v.get_shape())
+                snapshot_variable = tf.Variable(placeholder, trainable=False, collections=[])
+                self.snapshot_placeholders.append(placeholder)
+                snapshot_var_list[v.op.name] = snapshot_variable
+                initializers.append(snapshot_variable.initializer)
+            self.snapshot_assign = tf.group(*initializers)
+            self.snapshot_saver = tf.train.Saver(var_list=snapshot_var_list, max_to_keep=max_to_keep,
+                                                 keep_checkpoint_every_n_hours=keep_checkpoint_every_n_hours,
+                                                 save_relative_paths=self.saver_dir)
+
     def load_model(self, sess):
         checkpoint_path = tf.train.get_checkpoint_state(self.saver_dir)
         if checkpoint_path is not None:
-            self.saver.restore(sess, checkpoint_path.model_checkpoint_path)
+            SaverWrapper.restore_existing_variables(sess, self.saver, self.variables,
+                                                    checkpoint_path.model_checkpoint_path)
             print('Model restored from file: {}\n'.format(checkpoint_path.model_checkpoint_path))
         else:
             print('Model not found in: {}\n'.format(self.saver_dir))
 
+    @staticmethod
+    def restore_existing_variables(sess, saver, variables, checkpoint_path):
+        # the variables missing from the checkpoint (training state, accumulators and replica steps added after it was
+        # written) get their initial values, training continues from step 0 of the restored weights
+        saved_variables = tf.train.NewCheckpointReader(checkpoint_path).get_variable_to_shape_map()
+        missing = [v for v in variables if v.op.name not in saved_variables]
+        if len(missing) == 0:
+            saver.restore(sess, checkpoint_path)
+            return
+        print('variables missing from {} are initialized: {}\n'.format(checkpoint_path,
+                                                                       ', '.join([v.op.name for v in missing])))
+        tf.train.Saver(var_list=[v for v in variables if v.op.name in saved_variables]).restore(sess, checkpoint_path)
+        sess.run(tf.variables_initializer(missing))
+
     def save_model(self, sess, save_retries=3, global_step=None):
+        if self.asynchronous:
+            return self._save_model_asynchronous(sess, save_retries, global_step)
+        start_time = time.time()
+        return self._save_with_retries(self.saver, sess, save_retries, global_step, start_time)
+
+    def _save_model_asynchronous(self, sess, save_retries, global_step):
+        # only one save at a time, so at most one copy of the variables (the fetched values and the snapshot session
+        # while it is written) is held
+        self.wait_for_save()
+        start_time = time.time()
+        values = sess.run(self.snapshot_variables)
+        print('Model snapshot taken in {:.2f} seconds\n'.format(time.time() - start_time))
+        self.save_thread = threading.Thread(target=self._write_snapshot,
+                                            args=(values, save_retries, global_step, start_time),
+                                            name='checkpoint_writer')
+        self.save_thread.start()
+        return True
+
+    def _write_snapshot(self, values, save_retries, global_step, start_time):
+        with tf.Session(graph=self.snapshot_graph, config=self.session_config) as snapshot_sess:
+            snapshot_sess.run(self.snapshot_assign, dict(zip(self.snapshot_placeholders, values)))
+            self._save_with_retries(self.snapshot_saver, snapshot_sess, save_retries, global_step, start_time)
+
+    def _save_with_retries(self, saver, sess, save_retries, global_step, start_time):
         for i in range(save_retries):
             try:
                 # save model
-                self.saver.save(sess, self.saver_path, global_step=global_step)
-                print('Model saved\n')
+                saver.save(sess, self.saver_path, global_step=global_step)
+                print('Model saved in {:.2f} seconds\n'.format(time.time() - start_time))
                 return True
-            except:
-                pass
+            except Exception as e:
+                print('Failed to save model (attempt {} of {}): {}\n'.format(i + 1, save_retries, e))
         print('Failed to save model\n')
         return False
+
+    def wait_for_save(self):
+        if self.save_thread is not None:
+            self.save_thread.join()
+            self.save_thread = None
@@ -0,0 +1,225 @@
+import copy
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import yaml
+
+
+# runs a short training loop on synthetic two domain corpora and embedding files, and reports the graph build time,
+# the step times and the peak memory as the vocabulary size, the sentence length, the corpus size and the model size
+# change one at a time. every point runs in its own process (and directory), so the memory of the points is separate.
+# usage: python -m v1_embedding.scaling_harness [output.json]
+
+BASE_POINT = {
+    'vocabulary_size': 10000,
+    'sentence_length': 15,
+    'corpus_sentences': 20000,
+    # tiny or production (the sizes in gan.yml)
+    'model_size': 'tiny',
+    'steps': 10,
+    'warmup_steps': 2,
+    'seed': 0,
+}
+
+SCALING = {
+    'vocabulary_size': [10000, 50000, 200000],
+    'sentence_length': [10, 15, 30],
+    'corpus_sentences': [20000, 100000, 300000],
+    'model_size': ['tiny', 'production'],
+}
+
+# the small sizes commented in gan.yml
+TINY_MODEL = {
+    'model': {'encoder_hidden_states': [100], 'decoder_hidden_states': [50]},
+    'discriminator_embedding': {'encoder_hidden_states': [100], 'hidden_states': [50]},
+    'discriminator_content': {'hidden_states': [10]},
+}
+
+
+def get_points():
+    points = [dict(BASE_POINT)]
+    for dimension, values in sorted(SCALING.items()):
+        for value in values:
+            if value != BASE_POINT[dimension]:
+                point = dict(BASE_POINT)
+                point[dimension] = value
+                points.append(point)
+    return points
+
+
+def write_synthetic_corpora(point, random_state):
+    vocabulary = ['w{}'.format(i) for i in range(point['vocabulary_size'])]
+    # every word appears at least twice (min_word_occurrences) so the vocabulary of the model has the requested size
+    words = vocabulary + vocabulary
+    random_state.shuffle(words)
+    # the domains draw the rest of the words from different zipf distributions over the vocabulary
+    ranks = np.arange(1, len(vocabulary) + 1, dtype=np.float64)
+    probabilities = 1.0 / ranks / np.sum(1.0 / ranks)
+    os.makedirs(os.path.join('datasets', 'yelp'))
+    for domain, file_name in enumerate(['neg.txt', 'pos.txt']):
+        domain_vocabulary = list(vocabulary)
+        random_state.shuffle(domain_vocabulary)
+        domain_words = list(words)
+        lengths = random_state.randint(max(point['sentence_length'] // 2, 1), point['sentence_length'] + 1,
+                                       size=point['corpus_sentences'])
+        missing_words = len(domain_words) - sum(lengths)
+        if missing_words > 0:
+            # a corpus of fewer than 2 * vocabulary_size words is grown by lengthening its sentences, so every word of
+            # the doubled vocabulary is written
+            lengths += -(-missing_words // len(lengths))
+        extra_words = sum(lengths) - len(domain_words)
+        if extra_words > 0:
+            indices = random_state.choice(len(vocabulary), size=extra_words, p=probabilities)
+            domain_words += [domain_vocabulary[i] for i in indices]
+        with open(os.path.join('datasets', 'yelp', file_name), 'w') as f:
+            start = 0
+            for length in lengths:
+                f.write('{}\n'.format(' '.join(domain_words[start:start + length])))
+                start += length
+    return vocabulary
+
+
+def write_synthetic_embedding_file(vocabulary, embedding_size, end_of_sentence_token, unknown_token, random_state):
+    # the file name the pretrained embedding handler reads
+    os.makedirs('data')
+    file_name = os.path.join('data', 'embeddings-53708-{}-2.txt'.format(embedding_size))
+    with open(file_name, 'w') as f:
+        for word in [end_of_sentence_token, unknown_token] + vocabulary:
+            vector = random_state.randn(embedding_size)
+            f.write('{} {}\n'.format(word, ' '.join(['{:.5f}'.format(v) for v in vector])))
+
+
+def get_point_configs(point, config, operational_config):
+    config = copy.deepcopy(config)
+    if point['model_size'] == 'tiny':
+        for section, values in TINY_MODEL.items():
+            config[section].update(values)
+    config['sentence']['limit'] = point['corpus_sentences']
+    config['sentence']['min_length'] = point['sentence_length']
+    config['sentence']['max_length'] = point['sentence_length']
+    config['trainer']['seed'] = point['seed']
+    operational_config = copy.deepcopy(operational_config)
+    operational_config['tensorboard_frequency'] = 0
+    operational_config['load_model'] = False
+    operational_config['profiler']['signal_toggle'] = False
+    return config, operational_config
+
+
+def get_peak_memory_megabytes():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_point(point, config, operational_config):
+    # runs in the directory of the point
+    import tensorflow as tf
+    from v1_embedding.embedding_handler import EmbeddingHandler
+    from v1_embedding.model_trainer import ModelTrainer
+    from v1_embedding.pre_trained_embedding_handler import PreTrainedEmbeddingHandler
+    from datasets.yelp_helpers import YelpSentences
+
+    random_state = np.random.RandomState(point['seed'])
+    res = {}
+    start_time = time.time()
+    vocabulary = write_synthetic_corpora(point, random_state)
+    tokens = EmbeddingHandler(tempfile.mkdtemp())
+    write_synthetic_embedding_file(vocabulary, config['embedding']['word_size'], tokens.end_of_sentence_token,
+                                   tokens.unknown_token, random_state)
+    res['generate_seconds'] = time.time() - start_time
+
+    # fill the dataset and embedding caches of the trainer, so creating the trainer is mostly building the graph
+    start_time = time.time()
+    work_dir = os.path.join(os.getcwd(), 'models', 'ModelTrainer_{}'.format(config['model']['discriminator_type']))
+    datasets = [YelpSentences(positive=positive, limit_sentences=config['sentence']['limit'],
+                              dataset_cache_dir=os.path.join(work_dir, 'dataset_cache'), dataset_name=name)
+                for positive, name in [(not operational_config['positive_is_positive'], 'neg'),
+                                       (operational_config['positive_is_positive'], 'pos')]]
+    embedding_handler = PreTrainedEmbeddingHandler(os.path.join(work_dir, 'embedding'), datasets,
+                                                   config['embedding']['word_size'],
+                                                   config['embedding']['min_word_occurrences'])
+    res['vocabulary_size'] = embedding_handler.get_vocabulary_length()
+    # the vocabulary of the model is the requested vocabulary and the end of sentence and unknown tokens
+    assert res['vocabulary_size'] == point['vocabulary_size'] + 2, \
+        'vocabulary of {} words instead of {}'.format(res['vocabulary_size'], point['vocabulary_size'] + 2)
+    res['preprocess_seconds'] = time.time() - start_time
+    res['preprocess_peak_memory_mb'] = get_peak_memory_megabytes()
+
+    start_time = time.time()
+    trainer = ModelTrainer(config, operational_config)
+    res['graph_build_seconds'] = time.time() - start_time
+    res['graph_ops'] = len(tf.get_default_graph().get_operations())
+    res['graph_build_peak_memory_mb'] = get_peak_memory_megabytes()
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        trainer.do_before_train_loop(sess)
+        batches = trainer.batch_iterator.get_epoch(0)
+        for step_name, train_step in [('generator', trainer.model.generator_train_step),
+                                      ('discriminator', trainer.model.discriminator_train_step)]:
+            step_times = []
+            for i in range(point['warmup_steps'] + point['steps']):
+                feed_dict = trainer.get_train_feed_dict(next(batches))
+                start_time = time.time()
+                sess.run(train_step, feed_dict)
+                if i >= point['warmup_steps']:
+                    step_times.append(time.time() - start_time)
+            res['{}_step_seconds_p50'.format(step_name)] = float(np.percentile(step_times, 50))
+            res['{}_step_seconds_p90'.format(step_name)] = float(np.percentile(step_times, 90))
+            res['{}_sentences_per_second'.format(step_name)] = \
+                config['trainer']['batch_size'] / float(np.mean(step_times))
+    res['train_peak_memory_mb'] = get_peak_memory_megabytes()
+    return res
+
+
+def run_point_process(point):
+    # a fresh process in an empty directory for every point
+    point_dir = tempfile.mkdtemp(prefix='scaling_')
+    repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = repository_dir + os.pathsep + env.get('PYTHONPATH', '')
+    try:
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'v1_embedding.scaling_harness', 'point', json.dumps(point), repository_dir],
+            cwd=point_dir, env=env
+        ).decode()
+        # the result is the last line, the lines before are the logs of the trainer
+        return json.loads(output.strip().split('\n')[-1])
+    finally:
+        shutil.rmtree(point_dir, ignore_errors=True)
+
+
+def print_results(results):
+    columns = ['vocabulary_size', 'sentence_length', 'corpus_sentences', 'model_size', 'graph_build_seconds',
+               'generator_step_seconds_p50', 'discriminator_step_seconds_p50', 'train_peak_memory_mb']
+    print(' '.join(['{:>16s}'.format(c[:16]) for c in columns]))
+    for result in results:
+        values = [result['point'][c] if c in result['point'] else result['result'][c] for c in columns]
+        print(' '.join(['{:>16.3f}'.format(v) if isinstance(v, float) else '{:>16}'.format(v) for v in values]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'point':
+        point = json.loads(sys.argv[2])
+        with open(os.path.join(sys.argv[3], 'config', 'gan.yml'), 'r') as ymlfile:
+            config = yaml.load(ymlfile)
+        with open(os.path.join(sys.argv[3], 'config', 'operational.yml'), 'r') as ymlfile:
+            operational_config = yaml.load(ymlfile)
+        config, operational_config = get_point_configs(point, config, operational_config)
+        result = run_point(point, config, operational_config)
+        print(json.dumps(result))
+    else:
+        output_file = sys.argv[1] if len(sys.argv) > 1 else 'scaling_results.json'
+        results = []
+        for point in get_points():
+            print('running {}'.format(point))
+            results.append({'point': point, 'result': run_point_process(point)})
+            print_results(results)
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('results saved to {}'.format(output_file))
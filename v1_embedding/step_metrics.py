@@ -0,0 +1,89 @@
+import collections
+import time
+import numpy as np
+import tensorflow as tf
+
+
+class StepMetrics:
+    # wall time of every phase of the training loop and the throughput of the train steps, over the last window_size
+    # steps
+    phases = ['data_wait', 'train_run', 'summary_write', 'validation', 'checkpoint']
+
+    def __init__(self, pad_index, window_size=1000):
+        self.pad_index = pad_index
+        self.phase_times = {phase: collections.deque(maxlen=window_size) for phase in self.phases}
+        self.step_times = collections.deque(maxlen=window_size)
+        self.step_sentences = collections.deque(maxlen=window_size)
+        self.step_tokens = collections.deque(maxlen=window_size)
+        self.step_padded_tokens = collections.deque(maxlen=window_size)
+        self.current_step_time = 0.0
+        self.current_step_phases = set()
+        # the work after the last step of an epoch is not part of any step
+        self.last_epoch_end_time = 0.0
+
+    def add_epoch_end_time(self, seconds):
+        self.last_epoch_end_time = seconds
+
+    def add_time(self, phase, seconds):
+        self.phase_times[phase].append(seconds)
+        self.current_step_time += seconds
+        self.current_step_phases.add(phase)
+
+    def time_iterator(self, iterable, phase='data_wait'):
+        # yields the items of the iterable, the time to get every item is added to the phase
+        iterator = iter(iterable)
+        while True:
+            start_time = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add_time(phase, time.time() - start_time)
+            yield item
+
+    def end_step(self, batch):
+        # phases that did not run in this step took no time, so the percentiles are per step
+        for phase in self.phases:
+            if phase not in self.current_step_phases:
+                self.phase_times[phase].append(0.0)
+        sentences = np.concatenate([np.array(b.sentences) for b in batch])
+        lengths = np.concatenate([np.array(b.lengths) for b in batch])
+        self.step_times.append(self.current_step_time)
+        self.step_sentences.append(len(lengths))
+        self.step_tokens.append(int(np.sum(lengths)))
+        self.step_padded_tokens.append(int(np.sum(np.equal(sentences, self.pad_index))))
+        self.current_step_time = 0.0
+        self.current_step_phases = set()
+
+    def get_metrics(self):
+        total_time = float(np.sum(self.step_times))
+        all_tokens = float(np.sum(self.step_tokens) + np.sum(self.step_padded_tokens))
+        res = {
+            'sentences_per_second': float(np.sum(self.step_sentences)) / total_time if total_time > 0 else 0.0,
+            'tokens_per_second': float(np.sum(self.step_tokens)) / total_time if total_time > 0 else 0.0,
+            'padding_ratio': float(np.sum(self.step_padded_tokens)) / all_tokens if all_tokens > 0 else 0.0,
+            'epoch_end_last_ms': self.last_epoch_end_time * 1000.0,
+        }
+        for phase in self.phases:
+            times = np.array(self.phase_times[phase]) * 1000.0
+            for percentile in [50, 90, 99]:
+                res['{}_p{}_ms'.format(phase, percentile)] = float(np.percentile(times, percentile)) \
+                    if len(times) else 0.0
+        return res
+
+    def get_summary(self):
+        metrics = self.get_metrics()
+        return tf.Summary(value=[
+            tf.Summary.Value(tag='StepMetrics/{}'.format(k), simple_value=metrics[k]) for k in sorted(metrics)
+        ])
+
+    def get_log_line(self, global_step):
+        metrics = self.get_metrics()
+        phases = ' '.join([
+            '{} {:.1f}/{:.1f}/{:.1f}'.format(phase, metrics['{}_p50_ms'.format(phase)],
+                                             metrics['{}_p90_ms'.format(phase)], metrics['{}_p99_ms'.format(phase)])
+            for phase in self.phases
+        ])
+        return 'step {}: {:.1f} sentences/sec {:.1f} tokens/sec padding {:.1%} | p50/p90/p99 ms: {} | last epoch end ' \
+               '{:.1f} ms'.format(global_step, metrics['sentences_per_second'], metrics['tokens_per_second'],
+                                  metrics['padding_ratio'], phases, metrics['epoch_end_last_ms'])
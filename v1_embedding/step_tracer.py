@@ -0,0 +1,70 @@
+import collections
+import os
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class StepTracer:
+    # collects full traces of the train steps in [start_step, end_step), every trace is written as a chrome trace
+    # (open in chrome://tracing) and a table of the top ops of the window is written once it ends
+    def __init__(self, trace_dir, start_step, end_step, top_ops=20):
+        self.trace_dir = trace_dir
+        self.start_step = start_step
+        self.end_step = end_step
+        self.top_ops = top_ops
+        # op type => [count, total microseconds, total output bytes]
+        self.op_stats = collections.defaultdict(lambda: [0, 0, 0])
+        self.traced_steps = collections.Counter()
+        self.summary_written = False
+
+    def is_enabled(self):
+        return self.start_step is not None and self.end_step is not None
+
+    def should_trace(self, global_step):
+        return self.is_enabled() and self.start_step <= global_step < self.end_step
+
+    @staticmethod
+    def get_run_options():
+        return tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+
+    def add_trace(self, global_step, step_name, run_metadata):
+        if not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+        trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format(show_memory=True)
+        trace_file = os.path.join(self.trace_dir, 'step_{}_{}.json'.format(global_step, step_name))
+        with open(trace_file, 'w') as f:
+            f.write(trace)
+        self.traced_steps[step_name] += 1
+        for device_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in device_stats.node_stats:
+                # the timeline label is 'node_name = OpType(inputs)'
+                op_type = node_stats.timeline_label.split('(')[0].split(' = ')[-1].strip() or node_stats.node_name
+                output_bytes = sum([
+                    o.tensor_description.allocation_description.requested_bytes for o in node_stats.output
+                ])
+                stats = self.op_stats['{} ({})'.format(op_type, step_name)]
+                stats[0] += 1
+                stats[1] += node_stats.all_end_rel_micros
+                stats[2] += output_bytes
+
+    def write_summary_if_done(self, global_step):
+        if not self.is_enabled() or self.summary_written or global_step < self.end_step:
+            return
+        self.summary_written = True
+        lines = ['traced steps: {}'.format(', '.join(
+            ['{} {}'.format(count, name) for name, count in sorted(self.traced_steps.items())]
+        ))]
+        for title, key in [('time', 1), ('memory', 2)]:
+            lines.append('top ops by {}:'.format(title))
+            lines.append('{:60s} {:>8s} {:>14s} {:>16s}'.format('op', 'count', 'total ms', 'output MB'))
+            top = sorted(self.op_stats.items(), key=lambda item: item[1][key], reverse=True)[:self.top_ops]
+            for op, (count, micros, output_bytes) in top:
+                lines.append('{:60s} {:8d} {:14.2f} {:16.2f}'.format(op, count, micros / 1000.0,
+                                                                     output_bytes / (1024.0 * 1024.0)))
+        for name in ['generator', 'discriminator']:
+            if not any([step_name.startswith(name) for step_name in self.traced_steps]):
+                lines.append('warning: no {} step was traced'.format(name))
+        summary = '\n'.join(lines)
+        with open(os.path.join(self.trace_dir, 'top_ops.txt'), 'w') as f:
+            f.write(summary + '\n')
+        print(summary)
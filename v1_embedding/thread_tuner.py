@@ -0,0 +1,101 @@
+import copy
+import json
+import os
+import subprocess
+import sys
+import yaml
+import numpy as np
+import tensorflow as tf
+
+from v1_embedding.gan_model import GanModel
+from v1_embedding.model_trainer import ModelTrainer
+from v1_embedding.tower_scaling import create_synthetic_embedding_handler, create_synthetic_feed_dict, \
+    measure_train_steps
+
+
+# measures the train steps on synthetic batches for every thread setting in the grid of the operational config, and
+# writes the fastest one for this machine. the trainer uses it when threads.use_tuned is set. the thread pools of
+# tensorflow are created by the first session of a process, so every setting is measured in its own process.
+# usage: python -m v1_embedding.thread_tuner
+
+TUNER_VOCABULARY_SIZE = 10000
+
+
+def measure_threads(config, operational_config, embedding_handler, intra_op_threads, inter_op_threads, steps,
+                    warmup_steps=2):
+    operational_config = copy.deepcopy(operational_config)
+    operational_config['tensorboard_frequency'] = 0
+    graph = tf.Graph()
+    with graph.as_default():
+        model = GanModel(config, operational_config, embedding_handler)
+        session_config = tf.ConfigProto(allow_soft_placement=True,
+                                        intra_op_parallelism_threads=intra_op_threads,
+                                        inter_op_parallelism_threads=inter_op_threads)
+        ModelTrainer.set_towers_session_config(config, session_config)
+        with tf.Session(config=session_config) as sess:
+            sess.run(tf.global_variables_initializer())
+            feed_dict = create_synthetic_feed_dict(model, config, embedding_handler, np.random.RandomState(0))
+            return measure_train_steps(sess, model, config, feed_dict, steps, warmup_steps)
+
+
+def measure_threads_process(intra_op_threads, inter_op_threads):
+    # runs python -m v1_embedding.thread_tuner measure <intra> <inter> in the current directory
+    repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = repository_dir + os.pathsep + env.get('PYTHONPATH', '')
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'v1_embedding.thread_tuner', 'measure', str(intra_op_threads), str(inter_op_threads)],
+        env=env
+    ).decode()
+    # the result is the last line, the lines before are the logs of the model
+    return json.loads(output.strip().split('\n')[-1])
+
+
+def get_cycle_seconds(config, sentences_per_second):
+    # the time of one generator and discriminator cycle of the training loop, per sentence
+    generator_steps = config['trainer']['min_generator_steps']
+    discriminator_steps = config['trainer']['min_discriminator_steps']
+    return generator_steps / sentences_per_second['generator'] + \
+           discriminator_steps / sentences_per_second['discriminator']
+
+
+def tune_threads(config, operational_config):
+    threads_config = operational_config['threads']
+    best = None
+    print('intra  inter  generator sentences/sec  discriminator sentences/sec')
+    for intra_op_threads in threads_config['tuner_intra_op_threads']:
+        for inter_op_threads in threads_config['tuner_inter_op_threads']:
+            sentences_per_second = measure_threads_process(intra_op_threads, inter_op_threads)
+            print('{:5d}  {:5d}  {:23.1f}  {:27.1f}'.format(intra_op_threads, inter_op_threads,
+                                                           sentences_per_second['generator'],
+                                                           sentences_per_second['discriminator']))
+            cycle_seconds = get_cycle_seconds(config, sentences_per_second)
+            if best is None or cycle_seconds < best[0]:
+                best = (cycle_seconds, {
+                    'intra_op_threads': intra_op_threads,
+                    'inter_op_threads': inter_op_threads,
+                    'generator_sentences_per_second': float(sentences_per_second['generator']),
+                    'discriminator_sentences_per_second': float(sentences_per_second['discriminator']),
+                })
+    return best[1]
+
+
+if __name__ == "__main__":
+    with open("config/gan.yml", 'r') as ymlfile:
+        config = yaml.load(ymlfile)
+    with open("config/operational.yml", 'r') as ymlfile:
+        operational_config = yaml.load(ymlfile)
+    if len(sys.argv) == 4 and sys.argv[1] == 'measure':
+        embedding_handler = create_synthetic_embedding_handler(TUNER_VOCABULARY_SIZE, config['embedding']['word_size'])
+        sentences_per_second = measure_threads(config, operational_config, embedding_handler, int(sys.argv[2]),
+                                               int(sys.argv[3]), operational_config['threads']['tuner_steps'])
+        print(json.dumps({k: float(v) for k, v in sentences_per_second.items()}))
+        sys.exit(0)
+    best_threads = tune_threads(config, operational_config)
+    tuned_threads_file = ModelTrainer.get_tuned_threads_file(operational_config)
+    if not os.path.exists(os.path.dirname(tuned_threads_file)):
+        os.makedirs(os.path.dirname(tuned_threads_file))
+    with open(tuned_threads_file, 'w') as ymlfile:
+        yaml.dump(best_threads, ymlfile, default_flow_style=False)
+    print('best: {} intra op threads, {} inter op threads, saved to {}'.format(
+        best_threads['intra_op_threads'], best_threads['inter_op_threads'], tuned_threads_file))
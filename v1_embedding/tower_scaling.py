@@ -0,0 +1,90 @@
+import copy
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+import yaml
+
+from v1_embedding.embedding_handler import EmbeddingHandler
+from v1_embedding.gan_model import GanModel
+from v1_embedding.model_trainer import ModelTrainer
+
+
+# measures the throughput of the generator and discriminator train steps on synthetic batches as the number of towers
+# changes. usage: python -m v1_embedding.tower_scaling 1 2 4
+
+
+def create_synthetic_embedding_handler(vocabulary_size, embedding_size):
+    # an empty save directory, so nothing is loaded from cache
+    embedding_handler = EmbeddingHandler(tempfile.mkdtemp())
+    vocabulary = [embedding_handler.end_of_sentence_token, embedding_handler.unknown_token]
+    vocabulary += ['w{}'.format(i) for i in range(vocabulary_size - len(vocabulary))]
+    embedding_handler.vocabulary_to_internals(vocabulary)
+    embedding_handler.embedding_np = np.random.RandomState(0).randn(vocabulary_size, embedding_size).astype(np.float32)
+    return embedding_handler
+
+
+def create_synthetic_feed_dict(model, config, embedding_handler, random_state):
+    batch_size = config['trainer']['batch_size']
+    sentence_length = config['sentence']['min_length']
+    shape = (batch_size, sentence_length)
+    lengths = [sentence_length] * batch_size
+    return {
+        model.source_batch: random_state.randint(0, embedding_handler.get_vocabulary_length(), size=shape),
+        model.target_batch: random_state.randint(0, embedding_handler.get_vocabulary_length(), size=shape),
+        model.source_lengths: lengths,
+        model.target_lengths: lengths,
+        model.dropout_placeholder: config['model']['dropout'],
+        model.discriminator_dropout_placeholder: config['model']['discriminator_dropout'],
+    }
+
+
+def measure_towers(config, operational_config, embedding_handler, towers, steps, warmup_steps=2):
+    config = copy.deepcopy(config)
+    config['trainer']['towers'] = towers
+    operational_config = copy.deepcopy(operational_config)
+    operational_config['tensorboard_frequency'] = 0
+    graph = tf.Graph()
+    with graph.as_default():
+        model = GanModel(config, operational_config, embedding_handler)
+        session_config = tf.ConfigProto(allow_soft_placement=True)
+        ModelTrainer.set_towers_session_config(config, session_config)
+        with tf.Session(config=session_config) as sess:
+            sess.run(tf.global_variables_initializer())
+            feed_dict = create_synthetic_feed_dict(model, config, embedding_handler, np.random.RandomState(0))
+            return measure_train_steps(sess, model, config, feed_dict, steps, warmup_steps)
+
+
+def measure_train_steps(sess, model, config, feed_dict, steps, warmup_steps):
+    # sentences per second of every train step
+    res = {}
+    for step_name, train_step in [('generator', model.generator_train_step),
+                                  ('discriminator', model.discriminator_train_step)]:
+        for _ in range(warmup_steps):
+            sess.run(train_step, feed_dict)
+        start_time = time.time()
+        for _ in range(steps):
+            sess.run(train_step, feed_dict)
+        elapsed = time.time() - start_time
+        res[step_name] = config['trainer']['batch_size'] * steps / elapsed
+    return res
+
+
+if __name__ == "__main__":
+    towers_to_measure = [int(t) for t in sys.argv[1:]] or [1, 2, 4]
+    with open("config/gan.yml", 'r') as ymlfile:
+        config = yaml.load(ymlfile)
+    with open("config/operational.yml", 'r') as ymlfile:
+        operational_config = yaml.load(ymlfile)
+    embedding_handler = create_synthetic_embedding_handler(10000, config['embedding']['word_size'])
+    results = {}
+    for towers in towers_to_measure:
+        results[towers] = measure_towers(config, operational_config, embedding_handler, towers, steps=10)
+    print('towers  generator sentences/sec (speedup)  discriminator sentences/sec (speedup)')
+    base = results[towers_to_measure[0]]
+    for towers in towers_to_measure:
+        print('{:6d}  {:10.1f} ({:.2f}x)  {:10.1f} ({:.2f}x)'.format(
+            towers,
+            results[towers]['generator'], results[towers]['generator'] / base['generator'],
+            results[towers]['discriminator'], results[towers]['discriminator'] / base['discriminator']))
@@ -0,0 +1,29 @@
+import tensorflow as tf
+
+
+class TrainingState:
+    # the position of the training loop, saved with the model so a resumed run continues exactly where it stopped.
+    # with gradient accumulation it includes the update in progress: its update step, whether it trains the generator
+    # (-1 if unknown) and the number of its micro batches that were accumulated
+    def __init__(self, seed):
+        self.names = ['global_step', 'epoch', 'batch_index', 'seed', 'update_step', 'update_generator', 'micro_batch']
+        initial_values = {'seed': seed, 'update_step': -1, 'update_generator': -1}
+        self.variables = []
+        self.placeholders = []
+        assigns = []
+        with tf.variable_scope('TrainingState'):
+            for name in self.names:
+                initial_value = initial_values.get(name, 0)
+                variable = tf.Variable(initial_value, dtype=tf.int64, trainable=False, name=name)
+                placeholder = tf.placeholder(tf.int64, shape=(), name='{}_placeholder'.format(name))
+                self.variables.append(variable)
+                self.placeholders.append(placeholder)
+                assigns.append(tf.assign(variable, placeholder))
+        self.assign = tf.group(*assigns)
+
+    def get(self, sess):
+        return dict(zip(self.names, [int(v) for v in sess.run(self.variables)]))
+
+    def set(self, sess, global_step, epoch, batch_index, seed, update_step=-1, update_generator=-1, micro_batch=0):
+        values = [global_step, epoch, batch_index, seed, update_step, update_generator, micro_batch]
+        sess.run(self.assign, dict(zip(self.placeholders, values)))
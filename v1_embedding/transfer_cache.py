@@ -0,0 +1,97 @@
+import collections
+import sqlite3
+import sys
+import threading
+
+
+class TransferCache:
+    # LRU cache of transferred sentences keyed by the checkpoint and the token ids of the source sentence, bounded by
+    # number of entries and by (estimated) memory. if disk_path is given, entries are also kept in an sqlite file that
+    # survives restarts
+    def __init__(self, max_entries, max_megabytes, disk_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_megabytes * 1024 * 1024
+        self.entries = collections.OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk = None
+        if disk_path is not None:
+            self.disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self.disk.execute('CREATE TABLE IF NOT EXISTS transfers (key TEXT PRIMARY KEY, transferred TEXT)')
+            self.disk.commit()
+
+    @staticmethod
+    def get_key(checkpoint, token_ids):
+        return checkpoint, tuple(token_ids)
+
+    @staticmethod
+    def get_disk_key(key):
+        return '{}:{}'.format(key[0], ' '.join(str(i) for i in key[1]))
+
+    @staticmethod
+    def get_entry_size(key, transferred):
+        # the tuple, its int objects and the string
+        return sys.getsizeof(key[1]) + 28 * len(key[1]) + sys.getsizeof(transferred)
+
+    def get(self, checkpoint, token_ids):
+        key = TransferCache.get_key(checkpoint, token_ids)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            if self.disk is not None:
+                row = self.disk.execute('SELECT transferred FROM transfers WHERE key = ?',
+                                        (TransferCache.get_disk_key(key),)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self._put_in_memory(key, row[0])
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, checkpoint, token_ids, transferred):
+        key = TransferCache.get_key(checkpoint, token_ids)
+        with self.lock:
+            self._put_in_memory(key, transferred)
+            if self.disk is not None:
+                self.disk.execute('INSERT OR REPLACE INTO transfers VALUES (?, ?)',
+                                  (TransferCache.get_disk_key(key), transferred))
+
+    def commit(self):
+        # disk writes are committed once per batch
+        if self.disk is not None:
+            with self.lock:
+                self.disk.commit()
+
+    def _put_in_memory(self, key, transferred):
+        if key in self.entries:
+            self.current_bytes -= TransferCache.get_entry_size(key, self.entries.pop(key))
+        self.entries[key] = transferred
+        self.current_bytes += TransferCache.get_entry_size(key, transferred)
+        while len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= TransferCache.get_entry_size(evicted_key, evicted)
+            self.evictions += 1
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.disk_hits + self.misses
+            return {
+                'cache_entries': len(self.entries),
+                'cache_megabytes': float(self.current_bytes) / (1024 * 1024),
+                'cache_hits': self.hits,
+                'cache_disk_hits': self.disk_hits,
+                'cache_misses': self.misses,
+                'cache_evictions': self.evictions,
+                'cache_hit_ratio': float(self.hits + self.disk_hits) / requests if requests > 0 else 0.0,
+            }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.commit()
+            self.disk.close()
@@ -0,0 +1,235 @@
+import collections
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+import yaml
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from datasets.batch import Batch
+from v1_embedding.checkpoint_watcher import CheckpointWatcher
+from v1_embedding.exported_model import ExportedModel
+from v1_embedding.logger import init_logger
+from v1_embedding.model_exporter import get_embedding_handler, get_export_dir, get_work_dir
+from v1_embedding.transfer_cache import TransferCache
+
+
+class TransferRequest:
+    def __init__(self, sentence):
+        self.sentence = sentence
+        self.enqueue_time = time.time()
+        self.done = threading.Event()
+        self.result = None
+        # the checkpoint of the model that transferred the sentence
+        self.checkpoint = None
+        self.error = None
+
+
+class ServerMetrics:
+    def __init__(self, batch_size, window_size=10000):
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        # latencies (in seconds) of the last window_size sentences
+        self.latencies = collections.deque(maxlen=window_size)
+        self.batch_fills = collections.deque(maxlen=window_size)
+        self.total_batches = 0
+        self.total_sentences = 0
+
+    def add_batch(self, requests, end_time):
+        with self.lock:
+            self.total_batches += 1
+            self.total_sentences += len(requests)
+            self.batch_fills.append(float(len(requests)) / self.batch_size)
+            self.latencies.extend([end_time - r.enqueue_time for r in requests])
+
+    def get_metrics(self, queue_depth):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000.0
+            return {
+                'queue_depth': queue_depth,
+                'total_batches': self.total_batches,
+                'total_sentences': self.total_sentences,
+                'mean_batch_fill': float(np.mean(self.batch_fills)) if self.batch_fills else 0.0,
+                'p50_latency_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                'p99_latency_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            }
+
+
+class MicroBatcher:
+    # collects concurrent requests to a single batch: a batch is sent once it has batch_size sentences or the first
+    # sentence in it waited max_batch_latency seconds
+    def __init__(self, model, batch_size, max_batch_latency):
+        self.model = model
+        # a newly loaded model that replaces the current one before the next batch
+        self.pending_model = None
+        self.model_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.max_batch_latency = max_batch_latency
+        self.requests = queue.Queue()
+        self.metrics = ServerMetrics(batch_size)
+        self.worker = threading.Thread(target=self._run, name='micro_batcher')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def transfer(self, sentences):
+        # the errors are per sentence, a bad sentence does not fail the other sentences of its batch
+        requests = [TransferRequest(s) for s in sentences]
+        for r in requests:
+            if isinstance(r.sentence, str):
+                self.requests.put(r)
+            else:
+                r.error = ValueError('sentence is not a string: {}'.format(json.dumps(r.sentence)))
+                r.done.set()
+        for r in requests:
+            r.done.wait()
+        return [r.result for r in requests], [r.checkpoint for r in requests], \
+               [None if r.error is None else str(r.error) for r in requests]
+
+    def set_model(self, model):
+        with self.model_lock:
+            if self.pending_model is not None:
+                self.pending_model.close()
+            self.pending_model = model
+
+    def _swap_model(self):
+        # only called by the worker between batches, so no batch is running on the old model
+        with self.model_lock:
+            if self.pending_model is None:
+                return
+            old_model, self.model, self.pending_model = self.model, self.pending_model, None
+        old_model.close()
+        print('serving checkpoint: {}'.format(self.model.checkpoint))
+
+    def get_metrics(self):
+        metrics = self.metrics.get_metrics(self.requests.qsize())
+        metrics['checkpoint'] = self.model.checkpoint
+        if self.model.transfer_cache is not None:
+            metrics.update(self.model.transfer_cache.get_stats())
+        return metrics
+
+    def _collect_batch(self):
+        requests = [self.requests.get()]
+        deadline = requests[0].enqueue_time + self.max_batch_latency
+        while len(requests) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect_batch()
+            self._swap_model()
+            model = self.model
+            # tokenize every sentence on its own, so only the requests that fail get an error
+            batch_iterator = model.get_batch_iterator([], self.batch_size)
+            batch = Batch()
+            batch_requests = []
+            for r in requests:
+                try:
+                    sentence, length = batch_iterator.normalized_sentence(r.sentence)
+                except Exception as e:
+                    r.error = e
+                    continue
+                batch.add(sentence, length)
+                batch_requests.append(r)
+            try:
+                if batch.get_len() > 0:
+                    _, transferred = model.transfer_batch(batch)
+                    for r, t in zip(batch_requests, transferred):
+                        r.result = t
+                        r.checkpoint = model.checkpoint
+            except Exception as e:
+                for r in batch_requests:
+                    r.error = e
+            self.metrics.add_batch(requests, time.time())
+            for r in requests:
+                r.done.set()
+
+
+class TransferRequestHandler(BaseHTTPRequestHandler):
+    # POST /transfer {"sentences": [...]} => {"transferred": [...], "checkpoints": [...], "errors": [...]}, the errors
+    # are null for the sentences that were transferred
+    # GET /metrics => queue depth, batch fill and latency percentiles
+    micro_batcher = None
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        self._send_json(200, self.micro_batcher.get_metrics())
+
+    def do_POST(self):
+        if self.path != '/transfer':
+            self.send_error(404)
+            return
+        try:
+            content_length = int(self.headers['Content-Length'])
+            sentences = json.loads(self.rfile.read(content_length).decode('utf-8'))['sentences']
+            if not isinstance(sentences, list):
+                raise ValueError('sentences is not a list')
+        except Exception as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            transferred, checkpoints, errors = self.micro_batcher.transfer(sentences)
+            self._send_json(200, {'transferred': transferred, 'checkpoints': checkpoints, 'errors': errors})
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+
+    def _send_json(self, code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def run_server(micro_batcher, server_config):
+    TransferRequestHandler.micro_batcher = micro_batcher
+    server = ThreadingHTTPServer((server_config['host'], server_config['port']), TransferRequestHandler)
+    print('serving on http://{}:{}\n'.format(server_config['host'], server_config['port']))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    with open("config/gan.yml", 'r') as ymlfile:
+        config = yaml.load(ymlfile)
+    with open("config/operational.yml", 'r') as ymlfile:
+        operational_config = yaml.load(ymlfile)
+    init_logger(name)
+    cache_config = operational_config['transfer_cache']
+    transfer_cache = TransferCache(cache_config['max_entries'], cache_config['max_megabytes'],
+                                   cache_config['disk_path']) if cache_config['enabled'] else None
+    model = ExportedModel(get_export_dir(config), transfer_cache=transfer_cache)
+    server_config = operational_config['server']
+    micro_batcher = MicroBatcher(model, server_config['batch_size'], server_config['max_batch_latency_ms'] / 1000.0)
+    if server_config['hot_reload']:
+        CheckpointWatcher(config,
+                          get_embedding_handler(config, operational_config),
+                          os.path.join(get_work_dir(config), 'saver'),
+                          os.path.join(get_work_dir(config), 'export_versions'),
+                          micro_batcher.set_model,
+                          server_config['checkpoint_poll_seconds'],
+                          current_checkpoint=model.checkpoint,
+                          transfer_cache=transfer_cache,
+                          keep_versions=server_config['keep_export_versions']).start()
+    run_server(micro_batcher, server_config)
@@ -0,0 +1,177 @@
+import datetime
+import os
+import signal
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import yaml
+
+from datasets.multi_batch_iterator import MultiBatchIterator
+from v1_embedding.gan_model import GanModel
+from v1_embedding.logger import get_async_writer, init_logger
+from v1_embedding.model_exporter import get_embedding_handler, get_work_dir
+from v1_embedding.model_trainer import ModelTrainer
+from v1_embedding.saver_wrapper import SaverWrapper
+from v1_embedding.training_state import TrainingState
+
+
+# evaluates the most recent checkpoint of a training run on a held-out set in a separate process, so validation never
+# blocks the training loop
+
+
+class ValidationSidecar:
+    def __init__(self, config_file, operational_config_file, name, trainer_pid=None):
+        self.config = config_file
+        self.operational_config = operational_config_file
+        self.validation_config = self.operational_config['validation']
+        self.name = name
+        # the sidecar stops when the trainer that started it is gone
+        self.trainer_pid = trainer_pid
+        self.work_dir = get_work_dir(self.config)
+        self.saver_dir = os.path.join(self.work_dir, 'saver')
+        self.summaries_dir = os.path.join(self.work_dir, 'tensorboard')
+
+        self.embedding_handler = get_embedding_handler(self.config, self.operational_config)
+        self.batch_iterator = MultiBatchIterator(self.read_held_out_contents(),
+                                                 self.embedding_handler,
+                                                 self.config['sentence']['min_length'],
+                                                 self.config['trainer']['batch_size'],
+                                                 seed=0)
+        self.model = GanModel(self.config, self.operational_config, self.embedding_handler)
+        self.training_state = TrainingState(0)
+        self.transferred_indices = self.model.embedding_container.get_closest_words(
+            self.model.transferred_source_batch)
+        self.reconstructed_indices = self.model.embedding_container.get_closest_words(
+            self.model.reconstructed_targets_batch)
+        self.saver = tf.train.Saver()
+        self.end_of_sentence_index = self.embedding_handler.word_to_index[self.embedding_handler.end_of_sentence_token]
+
+    def read_held_out_contents(self):
+        # same order as the training datasets: negative (source) then positive (target)
+        positive_first = not self.operational_config['positive_is_positive']
+        files = [self.validation_config['negative_file'], self.validation_config['positive_file']]
+        if positive_first:
+            files.reverse()
+        contents = []
+        for file_name in files:
+            with open(file_name) as f:
+                contents.append(f.readlines()[:self.validation_config['max_sentences']])
+        return contents
+
+    def run(self):
+        summary_writer = tf.summary.FileWriter(os.path.join(self.summaries_dir, 'validation'))
+        last_checkpoint = None
+        # the towers of the model are placed on multiple cpu devices
+        session_config = tf.ConfigProto(allow_soft_placement=True,
+                                        device_count={'CPU': self.config['trainer']['towers']})
+        ModelTrainer.set_threads_session_config(self.operational_config, session_config)
+        with tf.Session(config=session_config) as sess:
+            while True:
+                checkpoint = tf.train.get_checkpoint_state(self.saver_dir)
+                if checkpoint is not None and checkpoint.model_checkpoint_path != last_checkpoint:
+                    try:
+                        SaverWrapper.restore_existing_variables(sess, self.saver, tf.global_variables(),
+                                                                checkpoint.model_checkpoint_path)
+                    except Exception as e:
+                        # the checkpoint may still be written, try again on the next poll
+                        print('failed to restore {}: {}'.format(checkpoint.model_checkpoint_path, e))
+                    else:
+                        last_checkpoint = checkpoint.model_checkpoint_path
+                        self.validate(sess, summary_writer)
+                if self.trainer_pid is not None and os.getppid() != self.trainer_pid:
+                    print('the trainer (pid {}) exited, stopping'.format(self.trainer_pid))
+                    return
+                time.sleep(self.validation_config['poll_seconds'])
+
+    def validate(self, sess, summary_writer):
+        start_time = time.time()
+        training_state = self.training_state.get(sess)
+        global_step, epoch_num = training_state['global_step'], training_state['epoch']
+        sources, targets, transferred, reconstructed = [], [], [], []
+        reconstruction_losses, discriminator_losses, accuracies = [], [], []
+        for batch in self.batch_iterator.get_epoch(0):
+            feed_dict = {
+                self.model.source_batch: batch[0].sentences,
+                self.model.target_batch: batch[1].sentences,
+                self.model.source_lengths: batch[0].lengths,
+                self.model.target_lengths: batch[1].lengths,
+                self.model.dropout_placeholder: 0.0,
+                self.model.discriminator_dropout_placeholder: 0.0,
+            }
+            transferred_result, reconstructed_result, reconstruction_loss, discriminator_loss, accuracy = sess.run([
+                self.transferred_indices, self.reconstructed_indices, self.model.reconstruction_loss,
+                self.model.discriminator_loss, self.model.accuracy
+            ], feed_dict)
+            sources.extend(self.translate_to_string(self.remove_by_length(batch[0])))
+            targets.extend(self.translate_to_string(self.remove_by_length(batch[1])))
+            transferred.extend(self.translate_to_string(self.take_prefix(transferred_result)))
+            reconstructed.extend(self.translate_to_string(self.take_prefix(reconstructed_result)))
+            reconstruction_losses.append(reconstruction_loss)
+            discriminator_losses.append(discriminator_loss)
+            accuracies.append(accuracy)
+
+        scalars = {
+            'reconstruction_loss': np.mean(reconstruction_losses),
+            'discriminator_loss': np.mean(discriminator_losses),
+            'accuracy': np.mean(accuracies),
+        }
+        summary_writer.add_summary(tf.Summary(value=[
+            tf.Summary.Value(tag=tag, simple_value=float(value)) for tag, value in scalars.items()
+        ]), global_step=global_step)
+        if self.model.evaluation_summary is not None:
+            samples = self.validation_config['text_samples']
+            summary_writer.add_summary(sess.run(self.model.evaluation_summary, {
+                self.model.text_watcher.placeholders['original_source']: sources[:samples],
+                self.model.text_watcher.placeholders['original_target']: targets[:samples],
+                self.model.text_watcher.placeholders['transferred']: transferred[:samples],
+                self.model.text_watcher.placeholders['reconstructed']: reconstructed[:samples],
+            }), global_step=global_step)
+        summary_writer.flush()
+
+        for log_name, sentences in [('source', sources), ('target', targets), ('transferred', transferred),
+                                    ('reconstructed', reconstructed)]:
+            self.print_to_file(global_step, epoch_num, sentences,
+                               os.path.join('logs', '{}_{}.log'.format(self.name, log_name)))
+        print('validation of global step {} on {} sentences took {:.1f} seconds: {}'.format(
+            global_step, len(sources), time.time() - start_time, scalars))
+
+    def remove_by_length(self, batch):
+        return [s[:l] for s, l in zip(batch.sentences, batch.lengths)]
+
+    def take_prefix(self, indices):
+        # only take the prefix before EOS
+        res = []
+        for s in indices:
+            s = s.tolist()
+            if self.end_of_sentence_index in s:
+                s = s[:s.index(self.end_of_sentence_index) + 1]
+            res.append(s)
+        return res
+
+    def translate_to_string(self, indices):
+        return [' '.join(s) for s in self.embedding_handler.get_index_to_word(indices)]
+
+    @staticmethod
+    def print_to_file(global_step, epoch_number, sentences, file_name):
+        ModelTrainer.print_to_file(global_step, epoch_number, sentences, file_name)
+
+
+def exit_on_terminate(signum, frame):
+    # the trainer stops the sidecar with SIGTERM, which skips the atexit handlers, so the queued logs are written here
+    get_async_writer().close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    # the name of the training run, so the logs of both processes match
+    name = sys.argv[1] if len(sys.argv) > 1 else datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    with open("config/gan.yml", 'r') as ymlfile:
+        config = yaml.load(ymlfile)
+    with open("config/operational.yml", 'r') as ymlfile:
+        operational_config = yaml.load(ymlfile)
+    init_logger('{}_validation'.format(name))
+    signal.signal(signal.SIGTERM, exit_on_terminate)
+    # the pid of the trainer when it started the sidecar
+    trainer_pid = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    ValidationSidecar(config, operational_config, name, trainer_pid).run()
@@ -24,23 +24,24 @@ from __future__ import print_function
 
 import collections
 import math
-import random
-import json
+import os
 import datetime
+import hashlib
+import json
+import threading
+import time
 import yaml
 
 from nltk import word_tokenize
 
 import numpy as np
+from six.moves import queue
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import tensorflow as tf
 
+from v1_embedding.pre_trained_embedding_handler import PreTrainedEmbeddingHandler
 
-filenames = ["datasets/yelp/neg.txt", "datasets/yelp/pos.txt"]
-with open("config/gan.yml", 'r') as ymlfile:
-    config = yaml.load(ymlfile)
-embedding_size = config['embedding']['word_size'] # Dimension of the embedding vector.
-threshold = config['embedding']['min_word_occurrences']
+# usage: python -m v1_embedding.w2v (the settings are in the word2vec section of config/gan.yml)
 
 
 def read_data(filenames):
@@ -53,12 +54,10 @@ def read_data(filenames):
                 data.extend(words)
     return data
 
-vocabulary = read_data(filenames)
-print('Data size', len(vocabulary))
 
 # Step 2: Build the dictionary and replace rare words with UNK token.
 
-def build_dataset(words):
+def build_dataset(words, threshold):
     """Process raw inputs into a dataset."""
     count = [['UNK', -1]]
     # count.extend(collections.Counter(words).most_common(n_words - 1))
@@ -66,173 +65,295 @@ def build_dataset(words):
     dictionary = dict()
     for word, _ in count:
         dictionary[word] = len(dictionary)
-    data = list()
-    unk_count = 0
-    for word in words:
-        if word in dictionary:
-            index = dictionary[word]
-        else:
-            index = 0  # dictionary['UNK']
-            unk_count += 1
-        data.append(index)
-    count[0][1] = unk_count
-    reversed_dictionary = dict(zip(dictionary.values(), dictionary.keys()))
-    return data, count, dictionary, reversed_dictionary
-
-data, count, dictionary, reverse_dictionary = build_dataset(vocabulary)
-del vocabulary  # Hint to reduce memory.
-print('Most common words (+UNK)', count[:5])
-print('Sample data', data[:10], [reverse_dictionary[i] for i in data[:10]])
-
-data_index = 0
-
-# Step 3: Function to generate a training batch for the skip-gram model.
-def generate_batch(batch_size, num_skips, skip_window):
-    global data_index
-    assert batch_size % num_skips == 0
-    assert num_skips <= 2 * skip_window
-    batch = np.ndarray(shape=(batch_size), dtype=np.int32)
-    labels = np.ndarray(shape=(batch_size, 1), dtype=np.int32)
-    span = 2 * skip_window + 1  # [ skip_window target skip_window ]
-    buffer = collections.deque(maxlen=span)
-    if data_index + span > len(data):
-        data_index = 0
-    buffer.extend(data[data_index:data_index + span])
-    data_index += span
-    for i in range(batch_size // num_skips):
-        target = skip_window  # target label at the center of the buffer
-        targets_to_avoid = [skip_window]
-        for j in range(num_skips):
-            while target in targets_to_avoid:
-                target = random.randint(0, span - 1)
-            targets_to_avoid.append(target)
-            batch[i * num_skips + j] = buffer[skip_window]
-            labels[i * num_skips + j, 0] = buffer[target]
-        if data_index == len(data):
-            # buffer[:] = data[:span]
-            for word in data[:span]:
-                buffer.append(word)
-            data_index = span
-        else:
-            buffer.append(data[data_index])
-            data_index += 1
-    # Backtrack a little bit to avoid skipping words in the end of a batch
-    data_index = (data_index + len(data) - span) % len(data)
-    return batch, labels
-
-# Step 4: Build and train a skip-gram model.
-
-batch_size = 128
-skip_window = 2  # How many words to consider left and right.
-num_skips = 2  # How many times to reuse an input to generate a label.
-
-# We pick a random validation set to sample nearest neighbors. Here we limit the
-# validation samples to the words that have a low numeric ID, which by
-# construction are also the most frequent.
-valid_size = 16  # Random set of words to evaluate similarity on.
-valid_window = 100  # Only pick dev samples in the head of the distribution.
-valid_examples = np.random.choice(valid_window, valid_size, replace=False)
-num_sampled = 64  # Number of negative examples to sample.
-
-vocabulary_size = len(count)
-graph = tf.Graph()
-
-with graph.as_default():
-    # Input data.
-    train_inputs = tf.placeholder(tf.int32, shape=[batch_size])
-    train_labels = tf.placeholder(tf.int32, shape=[batch_size, 1])
-    valid_dataset = tf.constant(valid_examples, dtype=tf.int32)
-
-    # Ops and variables pinned to the CPU because of missing GPU implementation
-    with tf.device('/cpu:0'):
-        # Look up embeddings for inputs.
-        embeddings = tf.Variable(
-            tf.random_uniform([vocabulary_size, embedding_size], -1.0, 1.0))
-        embed = tf.nn.embedding_lookup(embeddings, train_inputs)
-
-        # Construct the variables for the NCE loss
-        nce_weights = tf.Variable(
-            tf.truncated_normal([vocabulary_size, embedding_size],
-                                stddev=1.0 / math.sqrt(embedding_size)))
-        nce_biases = tf.Variable(tf.zeros([vocabulary_size]))
-
-    # Compute the average NCE loss for the batch.
-    # tf.nce_loss automatically draws a new sample of the negative labels each
-    # time we evaluate the loss.
-    loss = tf.reduce_mean(
-        tf.nn.nce_loss(weights=nce_weights,
-                       biases=nce_biases,
-                       labels=train_labels,
-                       inputs=embed,
-                       num_sampled=num_sampled,
-                       num_classes=vocabulary_size))
-
-    # Construct the SGD optimizer using a learning rate of 1.0.
-    optimizer = tf.train.GradientDescentOptimizer(1.0).minimize(loss)
-
-    # Compute the cosine similarity between minibatch examples and all embeddings.
-    norm = tf.sqrt(tf.reduce_sum(tf.square(embeddings), 1, keep_dims=True))
-    normalized_embeddings = embeddings / norm
-    valid_embeddings = tf.nn.embedding_lookup(
-        normalized_embeddings, valid_dataset)
-    similarity = tf.matmul(
-        valid_embeddings, normalized_embeddings, transpose_b=True)
-
-    # Add variable initializer.
-    init = tf.global_variables_initializer()
-
-# Step 5: Begin training.
-
-def save_embeddings(step, final):
-    if final:
-        embeddings_source = final_embeddings
-    else:
-        embeddings_source = normalized_embeddings.eval()
-    print(len(embeddings_source[0]) == embedding_size)
-
-    filename = "embeddings-"+str(count[0][1])+"-"+str(embedding_size) + "-" + str(threshold) + "-" + str(datetime.datetime.now().strftime('%d-%m-%Y_%H-%M-%S')) + str(step) + ".txt"
-    file = open(filename, "w")
-    for i in range(vocabulary_size):
-        emb = ""
-        for j in range(embedding_size):
-            emb += str(embeddings_source[i][j]) + " "
-        s = str(count[i][0]) + " " + emb + "\n"
-        file.write(s)
-    file.close()
-    print(len(embeddings_source[0]) == embedding_size)
-
-
-num_steps = 20000000
-
-with tf.Session(graph=graph) as session:
-    # We must initialize all variables before we use them.
-    init.run()
-    print('Initialized')
-
-    average_loss = 0
-    for step in xrange(num_steps):
-        batch_inputs, batch_labels = generate_batch(
-            batch_size, num_skips, skip_window)
-        feed_dict = {train_inputs: batch_inputs, train_labels: batch_labels}
-
-        # We perform one update step by evaluating the optimizer op (including it
-        # in the list of returned values for session.run()
-        _, loss_val = session.run([optimizer, loss], feed_dict=feed_dict)
-        average_loss += loss_val
-
-        if step % 200000 == 0:
-            if step > 0:
-                average_loss /= 200000
-            # The average loss is an estimate of the loss over the last --- batches.
-            print('Average loss at step ', step, ': ', average_loss)
-            # save_embeddings(step, False)
+    # an int32 array instead of a list of python ints, so batches are gathered with numpy
+    data = np.array([dictionary.get(word, 0) for word in words], dtype=np.int32)  # 0 is dictionary['UNK']
+    count[0][1] = int(np.sum(data == 0))
+    return data, count
+
+
+def get_window_offsets(skip_window):
+    # the positions of the context words relative to the center word: [-skip_window, ..., -1, 1, ..., skip_window]
+    return np.concatenate([np.arange(-skip_window, 0), np.arange(1, skip_window + 1)]).astype(np.int32)
+
+
+# Step 3: Generate the training batches for the skip-gram model.
+class SkipGramBatches:
+    # the batches of one pass over the data, every batch has batch_size // num_skips consecutive center words and
+    # num_skips different context words for each of them
+    def __init__(self, data, batch_size, num_skips, skip_window, random_state):
+        assert batch_size % num_skips == 0
+        assert num_skips <= 2 * skip_window
+        self.data = data
+        self.batch_size = batch_size
+        self.num_skips = num_skips
+        self.skip_window = skip_window
+        self.window_offsets = get_window_offsets(skip_window)
+        self.num_centers = batch_size // num_skips
+        self.random_state = random_state
+
+    def __len__(self):
+        return max(len(self.data) - 2 * self.skip_window, 0) // self.num_centers
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.get_batch(i * self.num_centers)
+
+    def get_batch(self, start):
+        centers = start + self.skip_window + np.arange(self.num_centers)
+        # the context words are the first offsets of a random permutation of the window
+        permutations = np.argsort(self.random_state.rand(self.num_centers, len(self.window_offsets)), axis=1)
+        offsets = self.window_offsets[permutations[:, :self.num_skips]]
+        batch = np.repeat(self.data[centers], self.num_skips)
+        labels = self.data[centers[:, np.newaxis] + offsets].reshape((self.batch_size, 1))
+        return batch, labels
+
+
+class BatchPrefetcher:
+    # generates the next batches in a background thread while the session runs
+    _end = object()
+
+    def __init__(self, batches, prefetch_batches):
+        self.batches = batches
+        self.queue = queue.Queue(maxsize=prefetch_batches)
+        self.thread = threading.Thread(target=self._prefetch_loop, name='batch_prefetcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _prefetch_loop(self):
+        for batch in self.batches:
+            self.queue.put(batch)
+        self.queue.put(self._end)
+
+    def __iter__(self):
+        while True:
+            batch = self.queue.get()
+            if batch is self._end:
+                return
+            yield batch
+
+
+class Word2VecTrainer:
+    def __init__(self, config):
+        self.w2v_config = config['word2vec']
+        self.embedding_size = config['embedding']['word_size']  # Dimension of the embedding vector.
+        self.threshold = config['embedding']['min_word_occurrences']
+        self.corpus_dir = os.path.join(self.w2v_config['work_dir'], 'corpus-{}-{}'.format(
+            self.threshold, self.get_corpus_key()))
+        self.random_state = np.random.RandomState(self.w2v_config['seed'])
+
+        self.data, self.count = self.load_corpus()
+        self.vocabulary_size = len(self.count)
+        print('Data size', len(self.data))
+        print('Most common words (+UNK)', self.count[:5])
+        # the end of the corpus is held out for the validation similarity
+        validation_tokens = int(len(self.data) * self.w2v_config['validation_fraction'])
+        self.train_data = self.data[:len(self.data) - validation_tokens]
+        self.validation_data = self.data[len(self.data) - validation_tokens:]
+        self.keep_probabilities = self.get_keep_probabilities()
+        self.validation_pairs = self.get_validation_pairs()
+        self._build_graph()
+
+    def get_corpus_key(self):
+        # the cached corpus is rebuilt when an input file changes or with another vocabulary (min_word_occurrences) or
+        # seed, so a stale corpus is never trained on
+        files = [[os.path.abspath(file_name), os.path.getsize(file_name), os.path.getmtime(file_name)]
+                 for file_name in self.w2v_config['files']]
+        key = json.dumps([files, self.threshold, self.w2v_config['seed']], sort_keys=True)
+        return hashlib.md5(key.encode('utf-8')).hexdigest()[:12]
+
+    def get_corpus_file_names(self):
+        return os.path.join(self.corpus_dir, 'corpus.int32'), os.path.join(self.corpus_dir, 'vocabulary.tsv')
+
+    def load_corpus(self):
+        # the corpus is tokenized once and kept as an int32 file that is memory mapped
+        corpus_file, vocabulary_file = self.get_corpus_file_names()
+        if not (os.path.exists(corpus_file) and os.path.exists(vocabulary_file)):
+            if not os.path.exists(self.corpus_dir):
+                os.makedirs(self.corpus_dir)
+            data, count = build_dataset(read_data(self.w2v_config['files']), self.threshold)
+            data.tofile(corpus_file)
+            with open(vocabulary_file, 'w') as f:
+                f.writelines(['{}\t{}\n'.format(word, c) for word, c in count])
+        with open(vocabulary_file) as f:
+            count = [[word, int(c)] for word, c in [line.rstrip('\n').split('\t') for line in f]]
+        return np.memmap(corpus_file, dtype=np.int32, mode='r'), count
+
+    def get_keep_probabilities(self):
+        # subsampling of frequent words: a word with frequency f is kept with probability (sqrt(f / t) + 1) * t / f
+        subsample_threshold = self.w2v_config['subsample_threshold']
+        counts = np.array([c for _, c in self.count], dtype=np.float64)
+        if subsample_threshold <= 0:
+            return np.ones_like(counts)
+        frequencies = counts / np.sum(counts)
+        ratio = subsample_threshold / np.maximum(frequencies, 1e-12)
+        return np.minimum((np.sqrt(1.0 / ratio) + 1.0) * ratio, 1.0)
+
+    def get_epoch_data(self):
+        # the words kept in this epoch, the pairs are built from the remaining words so the windows reach further
+        if np.all(self.keep_probabilities >= 1.0):
+            return self.train_data
+        keep = self.random_state.rand(len(self.train_data)) < self.keep_probabilities[self.train_data]
+        return self.train_data[keep]
+
+    def get_validation_pairs(self):
+        # co-occurring pairs of the held out data and random pairs, a good embedding separates them
+        validation_batches = SkipGramBatches(self.validation_data, self.w2v_config['batch_size'],
+                                             self.w2v_config['num_skips'], self.w2v_config['skip_window'],
+                                             self.random_state)
+        if len(validation_batches) == 0:
+            return None
+        batch_indices = self.random_state.choice(len(validation_batches),
+                                                 min(self.w2v_config['validation_batches'], len(validation_batches)),
+                                                 replace=False)
+        batches = [validation_batches.get_batch(i * validation_batches.num_centers) for i in batch_indices]
+        centers = np.concatenate([b for b, _ in batches])
+        contexts = np.concatenate([l[:, 0] for _, l in batches])
+        random_contexts = self.random_state.randint(0, self.vocabulary_size, size=len(centers)).astype(np.int32)
+        return centers, contexts, random_contexts
+
+    # Step 4: Build a skip-gram model.
+    def _build_graph(self):
+        batch_size = self.w2v_config['batch_size']
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            # Input data.
+            self.train_inputs = tf.placeholder(tf.int32, shape=[batch_size])
+            self.train_labels = tf.placeholder(tf.int32, shape=[batch_size, 1])
+
+            # Ops and variables pinned to the CPU because of missing GPU implementation
+            with tf.device('/cpu:0'):
+                # Look up embeddings for inputs.
+                embeddings = tf.Variable(
+                    tf.random_uniform([self.vocabulary_size, self.embedding_size], -1.0, 1.0))
+                embed = tf.nn.embedding_lookup(embeddings, self.train_inputs)
+
+                # Construct the variables for the NCE loss
+                nce_weights = tf.Variable(
+                    tf.truncated_normal([self.vocabulary_size, self.embedding_size],
+                                        stddev=1.0 / math.sqrt(self.embedding_size)))
+                nce_biases = tf.Variable(tf.zeros([self.vocabulary_size]))
+
+            # Compute the average NCE loss for the batch.
+            # tf.nce_loss automatically draws a new sample of the negative labels each
+            # time we evaluate the loss.
+            self.loss = tf.reduce_mean(
+                tf.nn.nce_loss(weights=nce_weights,
+                               biases=nce_biases,
+                               labels=self.train_labels,
+                               inputs=embed,
+                               num_sampled=self.w2v_config['num_sampled'],
+                               num_classes=self.vocabulary_size))
+
+            # Construct the SGD optimizer.
+            self.optimizer = tf.train.GradientDescentOptimizer(self.w2v_config['learn_rate']).minimize(self.loss)
+
+            norm = tf.sqrt(tf.reduce_sum(tf.square(embeddings), 1, keep_dims=True))
+            self.normalized_embeddings = embeddings / norm
+
+            # the validation similarity: the mean cosine similarity of the co-occurring pairs minus that of the
+            # random pairs
+            self.validation_centers = tf.placeholder(tf.int32, shape=[None])
+            self.validation_contexts = tf.placeholder(tf.int32, shape=[None])
+            self.validation_random_contexts = tf.placeholder(tf.int32, shape=[None])
+            centers = tf.nn.embedding_lookup(self.normalized_embeddings, self.validation_centers)
+            contexts = tf.nn.embedding_lookup(self.normalized_embeddings, self.validation_contexts)
+            random_contexts = tf.nn.embedding_lookup(self.normalized_embeddings, self.validation_random_contexts)
+            self.validation_similarity = tf.reduce_mean(tf.reduce_sum(centers * contexts, axis=1)) - \
+                                         tf.reduce_mean(tf.reduce_sum(centers * random_contexts, axis=1))
+
+            # Add variable initializer.
+            self.init = tf.global_variables_initializer()
+
+    def get_validation_similarity(self, session):
+        if self.validation_pairs is None:
+            return None
+        centers, contexts, random_contexts = self.validation_pairs
+        return session.run(self.validation_similarity, {
+            self.validation_centers: centers,
+            self.validation_contexts: contexts,
+            self.validation_random_contexts: random_contexts,
+        })
+
+    # Step 5: Begin training.
+    def train(self):
+        # returns the normalized embeddings of the epoch with the best validation similarity
+        log_steps = self.w2v_config['log_steps']
+        patience = self.w2v_config['patience']
+        best_similarity, best_embeddings, epochs_without_improvement = None, None, 0
+        with tf.Session(graph=self.graph) as session:
+            # We must initialize all variables before we use them.
+            session.run(self.init)
+            print('Initialized')
+
+            step = 0
             average_loss = 0
-
-    final_embeddings = normalized_embeddings.eval()
-
-
-save_embeddings(0, True)
-
+            for epoch in xrange(self.w2v_config['epochs']):
+                epoch_data = self.get_epoch_data()
+                batches = SkipGramBatches(epoch_data, self.w2v_config['batch_size'], self.w2v_config['num_skips'],
+                                          self.w2v_config['skip_window'], self.random_state)
+                print('epoch {}: {} words, {} batches'.format(epoch + 1, len(epoch_data), len(batches)))
+                if self.w2v_config['prefetch_batches'] > 0:
+                    batches = BatchPrefetcher(batches, self.w2v_config['prefetch_batches'])
+                for batch_inputs, batch_labels in batches:
+                    feed_dict = {self.train_inputs: batch_inputs, self.train_labels: batch_labels}
+
+                    # We perform one update step by evaluating the optimizer op (including it
+                    # in the list of returned values for session.run()
+                    _, loss_val = session.run([self.optimizer, self.loss], feed_dict=feed_dict)
+                    average_loss += loss_val
+                    step += 1
+
+                    if step % log_steps == 0:
+                        # The average loss is an estimate of the loss over the last log_steps batches.
+                        print('Average loss at step ', step, ': ', average_loss / log_steps)
+                        average_loss = 0
+
+                similarity = self.get_validation_similarity(session)
+                print('epoch {}: validation similarity {}'.format(epoch + 1, similarity))
+                if similarity is None or best_similarity is None or similarity > best_similarity:
+                    best_similarity = similarity
+                    best_embeddings = session.run(self.normalized_embeddings)
+                    epochs_without_improvement = 0
+                else:
+                    epochs_without_improvement += 1
+                    if patience > 0 and epochs_without_improvement >= patience:
+                        print('no improvement in {} epochs, stopping'.format(patience))
+                        break
+        return best_embeddings
+
+    def get_embeddings_file_name(self):
+        return os.path.join(self.w2v_config['work_dir'], "embeddings-" + str(self.count[0][1]) + "-" +
+                            str(self.embedding_size) + "-" + str(self.threshold) + "-" +
+                            str(datetime.datetime.now().strftime('%d-%m-%Y_%H-%M-%S')) + ".txt")
+
+    def save_embeddings(self, embeddings_source):
+        # the binary files are read by the pretrained embedding handler (memory mapped) instead of the text file.
+        # returns the matrix file and the text file (None if it is not exported)
+        start_time = time.time()
+        filename = self.get_embeddings_file_name()
+        vocabulary = [word for word, _ in self.count]
+        matrix_file, _ = PreTrainedEmbeddingHandler.save_binary(filename, vocabulary, embeddings_source)
+        print('embeddings saved to {}'.format(matrix_file))
+        text_file = None
+        if self.w2v_config['export_text']:
+            # every row is formatted by a single format operation, 9 significant digits keep the float32 values exact
+            row_format = ' '.join(['%.9g'] * self.embedding_size)
+            text_file = filename
+            with open(text_file, "w") as f:
+                f.write(''.join([
+                    '{} {}\n'.format(word, row_format % tuple(row)) for word, row in zip(vocabulary, embeddings_source)
+                ]))
+            print('embeddings saved to {}'.format(text_file))
+        print('export took {:.2f} seconds'.format(time.time() - start_time))
+        return matrix_file, text_file
+
+
+if __name__ == "__main__":
+    with open("config/gan.yml", 'r') as ymlfile:
+        config = yaml.load(ymlfile)
+    trainer = Word2VecTrainer(config)
+    final_embeddings = trainer.train()
+    trainer.save_embeddings(final_embeddings)
 
 
     # # Step 6: Visualize the embeddings.